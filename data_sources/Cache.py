@@ -1,14 +1,1180 @@
+import atexit
+import bisect
+import copy
 import hashlib
+import inspect
+import json
 import logging
 import os
 import pickle
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from collections import Counter, OrderedDict, defaultdict
 from functools import wraps
 
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+try:
+    from . import config as Config
+except ImportError:
+    import config as Config
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+
+#:float: lifetime in seconds of entries for requests without result, if not configured
+DEFAULT_NEGATIVE_TTL = 86400
+
+
+def _negative_ttl():
+    """ lifetime of entries for requests without result, always finite """
+    ttl = Config.get_config().get("cache_negative_ttl")
+    return ttl if ttl is not None else DEFAULT_NEGATIVE_TTL
+
+
+#:Pattern: names of the files of cache entries, i.e. a sha224 hash and the extension of a serializer
+_entry_name = re.compile(r"[0-9a-f]{56}\.(dat|arrow|parquet)")
+
+
+def is_entry_name(name):
+    """ whether a file in a cache folder belongs to a cache entry """
+    return _entry_name.fullmatch(name) is not None
+
+
+class CacheStats:
+    """
+    Hit/miss counters and latency histograms of a cache folder, by namespace
+
+    The latencies are sorted into logarithmic buckets, starting at 10 us and
+    doubling in width, which is enough to estimate percentiles.
+    """
+
+    counters = ["memory_hits", "disk_hits", "negative_hits", "misses", "bytes_read", "bytes_written", "saves"]
+    #:list: upper bounds of the latency buckets in seconds
+    buckets = [10e-6 * 2 ** i for i in range(21)]
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.values = defaultdict(Counter)
+        self.latency = defaultdict(lambda: [0] * (len(self.buckets) + 1))
+        self.hits = Counter()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.values)
+
+    def _observe(self, namespace, kind, seconds):
+        self.latency[(namespace, kind)][bisect.bisect_left(self.buckets, seconds)] += 1
+
+    def hit(self, namespace, filename, tier, nbytes, seconds):
+        """ record a successful load from the "memory" or "disk" tier, or of a "negative" entry """
+        with self._lock:
+            self.values[namespace][tier + "_hits"] += 1
+            self.values[namespace]["bytes_read"] += nbytes
+            self.hits[filename] += 1
+            self._observe(namespace, "load", seconds)
+
+    def miss(self, namespace):
+        with self._lock:
+            self.values[namespace]["misses"] += 1
+
+    def save(self, namespace, nbytes, seconds):
+        with self._lock:
+            self.values[namespace]["saves"] += 1
+            self.values[namespace]["bytes_written"] += nbytes
+            self._observe(namespace, "save", seconds)
+
+    @classmethod
+    def percentile(cls, histogram, q):
+        """ estimate the q-th percentile (0-100) from a latency histogram """
+        total = sum(histogram)
+        if total == 0:
+            return None
+        count = 0
+        for i, n in enumerate(histogram):
+            count += n
+            if count >= total * q / 100:
+                return cls.buckets[min(i, len(cls.buckets) - 1)]
+
+    def as_dict(self):
+        """ counters and latency histograms by namespace """
+        result = {}
+        for namespace in set(self.values) | {ns for ns, _ in self.latency}:
+            result[namespace] = dict(self.values[namespace])
+            for (ns, kind), histogram in self.latency.items():
+                if ns == namespace:
+                    result[namespace][kind + "_latency"] = list(histogram)
+        return result
+
+
+class CacheManager:
+    """
+    Keeps the size of one cache folder within its budget
+
+    Every entry is recorded in a small SQLite index inside the folder,
+    together with its size, last access and expiration time. The total size
+    is kept as a running sum, so that saving an entry never needs to walk the
+    directory. When the budget is exceeded, the least recently used entries
+    are removed until the folder is below the low water mark.
+    """
+
+    index_name = "cache_index.sqlite"
+    _managers = {}
+    _managers_lock = threading.Lock()
+
+    def __init__(self, folder, max_bytes=None, ttl=None, low_water=0.9, touch_interval=60, flush_interval=60):
+        config = Config.get_config()
+        self.folder = os.path.abspath(os.path.expanduser(folder))
+        #:int: size budget of the folder in bytes, None for no limit
+        self.max_bytes = max_bytes if max_bytes is not None else config.get("cache_max_bytes")
+        #:float: default lifetime of an entry in seconds, None for no limit
+        self.ttl = ttl if ttl is not None else config.get("cache_ttl")
+        #:float: fraction of max_bytes that remains after an eviction
+        self.low_water = low_water
+        #:float: minimum time in seconds between two updates of the access time
+        self.touch_interval = touch_interval
+        #:float: time in seconds between writing the statistics to the index
+        self.flush_interval = flush_interval
+        #:CacheStats: statistics of this process, that are not yet in the index
+        self.stats = CacheStats()
+        self._flushed = time.time()
+        self._touched = {}
+        self._lock = threading.RLock()
+        self._connection = None
+
+    @classmethod
+    def get(cls, folder):
+        """ get the shared manager of a cache folder """
+        folder = os.path.abspath(os.path.expanduser(folder))
+        with cls._managers_lock:
+            if folder not in cls._managers:
+                cls._managers[folder] = cls(folder)
+            return cls._managers[folder]
+
+    @classmethod
+    def flush_all(cls):
+        """ write the statistics of all managers to their index """
+        for manager in list(cls._managers.values()):
+            if not os.path.isdir(manager.folder):
+                continue
+            try:
+                manager.flush_stats()
+            except sqlite3.Error as ex:
+                logging.warning("Could not save cache statistics: %s" % ex)
+
+    @property
+    def index_file(self):
+        return os.path.join(self.folder, self.index_name)
+
+    #:dict: columns of the entries table
+    entry_columns = {
+        "filename": "TEXT PRIMARY KEY",
+        "size": "INTEGER",
+        "last_access": "REAL",
+        "expires": "REAL",
+        "namespace": "TEXT",
+        "hits": "INTEGER DEFAULT 0",
+        "key": "TEXT",
+        "created": "REAL",
+    }
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            os.makedirs(self.folder, exist_ok=True)
+            is_new = not os.path.exists(self.index_file)
+            con = sqlite3.connect(self.index_file, timeout=60, check_same_thread=False)
+            with con:
+                columns = ", ".join("%s %s" % c for c in self.entry_columns.items())
+                con.execute("CREATE TABLE IF NOT EXISTS entries (%s)" % columns)
+                # Add columns that were introduced after the index was created
+                existing = [row[1] for row in con.execute("PRAGMA table_info(entries)")]
+                for name, definition in self.entry_columns.items():
+                    if name not in existing:
+                        con.execute("ALTER TABLE entries ADD COLUMN %s %s" % (name, definition))
+                con.execute(
+                    "CREATE INDEX IF NOT EXISTS entries_access ON entries (last_access)"
+                )
+                con.execute(
+                    "CREATE INDEX IF NOT EXISTS entries_namespace ON entries (namespace)"
+                )
+                con.execute(
+                    "CREATE TABLE IF NOT EXISTS totals (id INTEGER PRIMARY KEY, size INTEGER)"
+                )
+                con.execute("INSERT OR IGNORE INTO totals VALUES (0, 0)")
+                con.execute(
+                    "CREATE TABLE IF NOT EXISTS stats ("
+                    "namespace TEXT, name TEXT, value INTEGER, "
+                    "PRIMARY KEY (namespace, name))"
+                )
+            self._connection = con
+            if is_new:
+                self._adopt()
+            else:
+                self._disown()
+        return self._connection
+
+    def _adopt(self):
+        """ register files that were cached before the index existed """
+        with self.connection as con:
+            for entry in os.scandir(self.folder):
+                # The folder may be shared with other programs, leave their files alone
+                if not is_entry_name(entry.name) or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                self._insert(con, entry.name, stat.st_size, stat.st_mtime, None, created=stat.st_mtime)
+
+    def _disown(self):
+        """ forget files of other programs, that older versions registered as entries """
+        with self.connection as con:
+            rows = con.execute("SELECT filename FROM entries").fetchall()
+            for (name,) in rows:
+                if not is_entry_name(name):
+                    self._delete(con, name)
+
+    def _insert(self, con, filename, size, last_access, expires, namespace=None, key=None, created=None):
+        row = con.execute(
+            "SELECT size FROM entries WHERE filename = ?", (filename,)
+        ).fetchone()
+        old_size = row[0] if row is not None else 0
+        created = created if created is not None else last_access
+        con.execute(
+            "INSERT OR REPLACE INTO entries "
+            "(filename, size, last_access, expires, namespace, key, created) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (filename, size, last_access, expires, namespace, key, created),
+        )
+        con.execute("UPDATE totals SET size = size + ? WHERE id = 0", (size - old_size,))
+
+    def _delete(self, con, filename):
+        row = con.execute(
+            "SELECT size FROM entries WHERE filename = ?", (filename,)
+        ).fetchone()
+        if row is None:
+            return
+        con.execute("DELETE FROM entries WHERE filename = ?", (filename,))
+        con.execute("UPDATE totals SET size = size - ? WHERE id = 0", (row[0],))
+
+    def register(self, filename, ttl=None, namespace=None, key=None):
+        """
+        Record a newly written entry and evict old entries if necessary
+
+        Parameters
+        ----------
+        filename : str
+            path of the cache file
+        ttl : float, optional
+            lifetime of the entry in seconds, by default the ttl of the manager
+        namespace : str, optional
+            namespace of the entry
+        key : str, optional
+            human readable description of the entry
+        """
+        ttl = ttl if ttl is not None else self.ttl
+        name = os.path.basename(filename)
+        size = os.path.getsize(filename)
+        now = time.time()
+        expires = now + ttl if ttl is not None else None
+        with self._lock:
+            with self.connection as con:
+                self._insert(con, name, size, now, expires, namespace, key)
+            self._touched[name] = (now, expires)
+            if self.max_bytes is not None and self.total_size() > self.max_bytes:
+                self.evict(keep=name)
+            if now - self._flushed > self.flush_interval:
+                self.flush_stats()
+
+    def touch(self, filename):
+        """
+        Mark an entry as used. Returns False if the entry has expired.
+
+        The access time is only written to the index once per touch_interval,
+        which is accurate enough for the LRU order. In between, the expiration
+        time is taken from memory, so that repeated hits never query the index.
+        """
+        name = os.path.basename(filename)
+        now = time.time()
+        with self._lock:
+            touched, expires = self._touched.get(name, (0, None))
+            if now - touched <= self.touch_interval:
+                return expires is None or expires >= now
+
+            row = self.connection.execute(
+                "SELECT expires FROM entries WHERE filename = ?", (name,)
+            ).fetchone()
+            if row is None:
+                # Written by someone who does not use the index
+                if is_entry_name(name) and os.path.exists(filename):
+                    self.register(filename)
+                return True
+            expires = row[0]
+            if expires is not None and expires < now:
+                return False
+            with self.connection as con:
+                con.execute(
+                    "UPDATE entries SET last_access = ? WHERE filename = ?",
+                    (now, name),
+                )
+            self._touched[name] = (now, expires)
+        return True
+
+    def remove(self, filename):
+        """ remove an entry from the folder and the index """
+        name = os.path.basename(filename)
+        with self._lock:
+            try:
+                os.remove(os.path.join(self.folder, name))
+            except FileNotFoundError:
+                pass
+            with self.connection as con:
+                self._delete(con, name)
+            self._touched.pop(name, None)
+
+    def total_size(self):
+        """ total size of all entries in bytes """
+        row = self.connection.execute("SELECT size FROM totals WHERE id = 0").fetchone()
+        return row[0]
+
+    def evict(self, max_bytes=None, keep=None):
+        """
+        Remove expired entries, and then the least recently used entries,
+        until the folder is below the low water mark of max_bytes
+
+        The entry keep (e.g. the one that was just written) is never removed.
+        """
+        max_bytes = max_bytes if max_bytes is not None else self.max_bytes
+        keep = os.path.basename(keep) if keep is not None else ""
+        with self._lock:
+            self.remove_expired()
+
+            if max_bytes is None:
+                return
+            target = max_bytes * self.low_water
+            while self.total_size() > target:
+                oldest = self.connection.execute(
+                    "SELECT filename FROM entries WHERE filename != ? "
+                    "ORDER BY last_access LIMIT 64",
+                    (keep,),
+                ).fetchall()
+                if len(oldest) == 0:
+                    break
+                for (name,) in oldest:
+                    logging.info("Evicting cached file: %s" % name)
+                    self.remove(name)
+                    if self.total_size() <= target:
+                        break
+
+    def remove_expired(self):
+        """ remove all expired entries, returns the number removed """
+        with self._lock:
+            expired = self.connection.execute(
+                "SELECT filename FROM entries WHERE expires < ?", (time.time(),)
+            ).fetchall()
+            for (name,) in expired:
+                self.remove(name)
+        return len(expired)
+
+    def flush_stats(self):
+        """ add the statistics of this process to the ones stored in the index """
+        with self._lock:
+            if len(self.stats) == 0:
+                return
+            stats, self.stats = self.stats, CacheStats()
+            self._flushed = time.time()
+            with self.connection as con:
+                rows = []
+                for namespace, values in stats.values.items():
+                    rows += [(namespace, name, value) for name, value in values.items()]
+                for (namespace, kind), histogram in stats.latency.items():
+                    rows += [
+                        (namespace, "%s_latency_%i" % (kind, i), n)
+                        for i, n in enumerate(histogram) if n > 0
+                    ]
+                con.executemany(
+                    "INSERT INTO stats VALUES (?, ?, ?) ON CONFLICT (namespace, name) "
+                    "DO UPDATE SET value = value + excluded.value",
+                    [(str(ns), name, value) for ns, name, value in rows],
+                )
+                con.executemany(
+                    "UPDATE entries SET hits = hits + ? WHERE filename = ?",
+                    [(n, os.path.basename(f)) for f, n in stats.hits.items()],
+                )
+
+    def load_stats(self):
+        """
+        Statistics of all processes that used this folder
+
+        Returns
+        -------
+        stats : CacheStats
+            the stored statistics, including the ones of this process
+        """
+        self.flush_stats()
+        stats = CacheStats()
+        for namespace, name, value in self.connection.execute("SELECT * FROM stats"):
+            if "_latency_" in name:
+                kind, i = name.split("_latency_")
+                stats.latency[(namespace, kind)][int(i)] = value
+            else:
+                stats.values[namespace][name] = value
+        return stats
+
+    def entries(self, pattern=None, namespace=None):
+        """
+        List the entries in the index
+
+        Parameters
+        ----------
+        pattern : str, optional
+            glob pattern (e.g. "*Trappist*") that the key has to match
+        namespace : str, optional
+            only list entries of this namespace (also a glob pattern)
+
+        Returns
+        -------
+        entries : list
+            rows of (filename, namespace, key, size, created, last_access, hits)
+        """
+        self.flush_stats()
+        query = (
+            "SELECT filename, namespace, key, size, created, last_access, hits "
+            "FROM entries WHERE 1"
+        )
+        params = []
+        if pattern is not None:
+            query += " AND key GLOB ?"
+            params.append(pattern)
+        if namespace is not None:
+            query += " AND namespace GLOB ?"
+            params.append(namespace)
+        return self.connection.execute(query + " ORDER BY created", params).fetchall()
+
+    def read(self, filename):
+        """
+        Load the data of an entry, e.g. one listed by entries
+
+        Entries for requests without result return a NotFound object.
+        Raises FileNotFoundError, if the entry does not exist (anymore).
+        """
+        extension = os.path.splitext(filename)[1]
+        for serializer in default_serializers:
+            if serializer.extension == extension:
+                break
+        else:
+            serializer = PickleSerializer()
+        try:
+            return serializer.load(os.path.join(self.folder, os.path.basename(filename)))
+        except (ValueError, EOFError, OSError):
+            raise FileNotFoundError("File not found: %s" % filename)
+
+    def purge(self, pattern=None, namespace=None):
+        """ remove all entries matching pattern and namespace, returns the number removed """
+        entries = self.entries(pattern, namespace)
+        for entry in entries:
+            self.remove(entry[0])
+        return len(entries)
+
+    def hot_keys(self, n=10):
+        """ the n entries with the most hits, as (filename, namespace, hits, size) """
+        self.flush_stats()
+        return self.connection.execute(
+            "SELECT filename, namespace, hits, size FROM entries "
+            "ORDER BY hits DESC LIMIT ?", (n,)
+        ).fetchall()
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats.clear()
+            with self.connection as con:
+                con.execute("DELETE FROM stats")
+                con.execute("UPDATE entries SET hits = 0")
+
+    def clear(self):
+        """ remove all entries """
+        with self._lock:
+            names = self.connection.execute("SELECT filename FROM entries").fetchall()
+            for (name,) in names:
+                self.remove(name)
+
+
+class MemoryCache:
+    """
+    Bounded in-memory LRU in front of the cache files
+
+    Entries are keyed by the cache filename (i.e. the hash of the info) and
+    remember the modification time of the file they were read from. A hit only
+    costs a stat of that file, so entries that were rewritten or evicted by
+    another process are never returned.
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None):
+        config = Config.get_config()
+        #:int: maximum number of objects kept in memory
+        self.max_entries = max_entries if max_entries is not None else config.get("cache_memory_entries", 256)
+        #:int: maximum size of all objects (as measured on disk) in bytes
+        self.max_bytes = max_bytes if max_bytes is not None else config.get("cache_memory_bytes")
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, filename):
+        """ return the object cached for filename, raises KeyError if there is none """
+        try:
+            mtime = os.stat(filename).st_mtime_ns
+        except FileNotFoundError:
+            self.discard(filename)
+            raise KeyError(filename)
+        with self._lock:
+            data, size, cached_mtime = self._entries[filename]
+            if cached_mtime != mtime:
+                del self._entries[filename]
+                self.size -= size
+                raise KeyError(filename)
+            self._entries.move_to_end(filename)
+        return data
+
+    def put(self, filename, data):
+        """ store data read from filename """
+        stat = os.stat(filename)
+        with self._lock:
+            if filename in self._entries:
+                self.size -= self._entries.pop(filename)[1]
+            self._entries[filename] = (data, stat.st_size, stat.st_mtime_ns)
+            self.size += stat.st_size
+            while len(self._entries) > 0 and (
+                len(self._entries) > self.max_entries
+                or (self.max_bytes is not None and self.size > self.max_bytes)
+            ):
+                _, (_, size, _) = self._entries.popitem(last=False)
+                self.size -= size
+
+    def discard(self, filename):
+        with self._lock:
+            if filename in self._entries:
+                self.size -= self._entries.pop(filename)[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+atexit.register(CacheManager.flush_all)
+
+#:MemoryCache: memory tier shared by all cache folders of this process
+memory = MemoryCache()
+
+
+def _set_readonly(values):
+    if hasattr(values, "flags") and hasattr(values.flags, "writeable"):
+        values.flags.writeable = False
+
+
+def _freeze(data):
+    """
+    make the data of numpy arrays, DataFrames and astropy tables read-only,
+    so that shared objects are not modified by accident
+
+    Only numpy buffers are protected, e.g. not extension arrays of pandas
+    or other python objects.
+    """
+    if pd is not None and isinstance(data, (pd.DataFrame, pd.Series)):
+        for values in getattr(data._mgr, "arrays", []):
+            _set_readonly(values)
+    elif hasattr(data, "itercols"):
+        # Astropy Table
+        for column in data.itercols():
+            _set_readonly(column)
+    else:
+        _set_readonly(data)
+    return data
+
+
+def _view(data):
+    """
+    new container around the same (read-only) data, so that e.g. adding a
+    column does not change the shared object
+    """
+    if pd is not None and isinstance(data, (pd.DataFrame, pd.Series)):
+        return data.copy(deep=False)
+    elif hasattr(data, "itercols"):
+        return data.copy(copy_data=False)
+    return data
+
+
+class Codec:
+    """ Compression codec of cache entries """
+
+    def __init__(self, name, compress, decompress):
+        self.name = name
+        self.compress = compress
+        self.decompress = decompress
+
+
+def _identity(data):
+    return data
+
+
+#:dict: available codecs by name
+codecs = {
+    "none": Codec("none", _identity, _identity),
+    "zlib": Codec("zlib", zlib.compress, zlib.decompress),
+}
+if zstandard is not None:
+    codecs["zstd"] = Codec(
+        "zstd",
+        lambda data: zstandard.ZstdCompressor(level=3).compress(data),
+        lambda data: zstandard.ZstdDecompressor().decompress(data),
+    )
+if lz4 is not None:
+    codecs["lz4"] = Codec("lz4", lz4.frame.compress, lz4.frame.decompress)
+
+
+#:set: codecs that were asked for, but are not installed (or not supported by Arrow IPC)
+_missing_codecs = set()
+
+
+class CodecUnavailableError(LookupError):
+    """ A cache entry is compressed with a codec that is not installed """
+
+
+def get_codec(name):
+    """
+    Get the codec with the given name
+
+    Falls back to no compression (with a warning) for codecs whose library
+    is not installed.
+    """
+    if name is None:
+        name = "none"
+    if name not in ["none", "zlib", "zstd", "lz4"]:
+        raise ValueError("codec should be one of none, zlib, zstd, lz4")
+    if name not in codecs:
+        # Not registered in codecs, so that entries written with it by
+        # others are still recognized as such
+        if name not in _missing_codecs:
+            logging.warning("Codec %s is not available, cache entries are not compressed" % name)
+            _missing_codecs.add(name)
+        return codecs["none"]
+    return codecs[name]
+
+
+class PickleSerializer:
+    """
+    Store any python object as a pickle
+
+    Compressed entries start with a small header, that records the codec.
+    Entries without header (i.e. starting with the pickle protocol) are
+    plain pickles, as written by earlier versions.
+    """
+
+    extension = ".dat"
+    #:bytes: marks the start of the header
+    magic = b"DSC1"
+    header_size = 12
+
+    def accepts(self, data):
+        return True
+
+    def dump(self, data, filename, codec="none"):
+        codec = get_codec(codec)
+        with open(filename, "wb") as f:
+            if codec.name == "none":
+                pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+            else:
+                f.write(self.magic + codec.name.encode().ljust(8, b"\0"))
+                f.write(codec.compress(pickle.dumps(data, pickle.HIGHEST_PROTOCOL)))
+
+    def load(self, filename, columns=None):
+        with open(filename, "rb") as f:
+            header = f.read(self.header_size)
+            if header.startswith(self.magic):
+                name = header[len(self.magic):].rstrip(b"\0").decode()
+                if name not in codecs:
+                    raise CodecUnavailableError("Codec %s is not available" % name)
+                data = pickle.loads(codecs[name].decompress(f.read()))
+            else:
+                f.seek(0)
+                data = pickle.load(f)
+        if columns is not None:
+            data = data[list(columns)]
+        return data
+
+
+def is_string_column(values):
+    """ whether all values are strings (or None) """
+    return all(type(v) is str or v is None for v in values)
+
+
+class ArrowSerializer:
+    """
+    Store pandas DataFrames in a columnar format
+
+    By default the Arrow IPC (Feather v2) format is used, which is read with
+    memory mapping, so that only the requested columns are actually read from
+    disk. Alternatively the tables can be stored as Parquet. Requires pyarrow.
+    The attrs of the DataFrame (e.g. units) are stored as json in the schema
+    metadata.
+    """
+
+    def __init__(self, format="ipc"):
+        if format not in ["ipc", "parquet"]:
+            raise ValueError("format should be one of ipc, parquet")
+        self.format = format
+        self.extension = ".arrow" if format == "ipc" else ".parquet"
+
+    def accepts(self, data):
+        if pa is None or pd is None or not isinstance(data, pd.DataFrame):
+            return False
+        # Arrow only supports unique string column names
+        if not data.columns.is_unique or not all(isinstance(c, str) for c in data.columns):
+            return False
+        # Object columns only survive the round trip if they hold strings,
+        # e.g. lists come back as arrays, and nan in strings as None
+        columns = [data[c] for c in data.columns if data[c].dtype == object]
+        if data.index.dtype == object:
+            columns.append(data.index)
+        if not all(is_string_column(column) for column in columns):
+            return False
+        try:
+            json.dumps(data.attrs)
+        except (TypeError, ValueError):
+            return False
+        return True
+
+    def _ipc_compression(self, codec):
+        """
+        the buffer compression of Arrow IPC for a codec
+
+        Arrow IPC only supports zstd and lz4, which Arrow implements itself.
+        Other codecs (zlib) are replaced by one of them, with a warning.
+        """
+        if codec is None or codec == "none":
+            return None
+        if codec not in ["zlib", "zstd", "lz4"]:
+            raise ValueError("codec should be one of none, zlib, zstd, lz4")
+        candidates = [codec] if codec in ["zstd", "lz4"] else ["zstd", "lz4"]
+        for name in candidates:
+            if pa.Codec.is_available(name):
+                if name != codec and ("ipc", codec) not in _missing_codecs:
+                    logging.warning(
+                        "Arrow IPC does not support %s, DataFrames are compressed with %s" % (codec, name)
+                    )
+                    _missing_codecs.add(("ipc", codec))
+                return name
+        if ("ipc", codec) not in _missing_codecs:
+            logging.warning("Codec %s is not available in Arrow, DataFrames are not compressed" % codec)
+            _missing_codecs.add(("ipc", codec))
+        return None
+
+    def dump(self, data, filename, codec="none"):
+        # The codec is recorded by Arrow itself
+        table = pa.Table.from_pandas(data)
+        if data.attrs:
+            metadata = dict(table.schema.metadata or {})
+            metadata[b"attrs"] = json.dumps(data.attrs).encode()
+            table = table.replace_schema_metadata(metadata)
+        if self.format == "ipc":
+            options = pa.ipc.IpcWriteOptions(compression=self._ipc_compression(codec))
+            with pa.OSFile(filename, "wb") as sink:
+                with pa.ipc.new_file(sink, table.schema, options=options) as writer:
+                    writer.write_table(table)
+        else:
+            codec = get_codec(codec).name
+            compression = {"none": "none", "zlib": "gzip"}.get(codec, codec)
+            pq.write_table(table, filename, compression=compression)
+
+    def _columns(self, schema, columns):
+        """ add the index columns to the requested columns """
+        if columns is None:
+            return None
+        columns = list(columns)
+        metadata = schema.pandas_metadata or {}
+        for index in metadata.get("index_columns", []):
+            if isinstance(index, str) and index not in columns:
+                columns.append(index)
+        return columns
+
+    @staticmethod
+    def _to_pandas(table):
+        data = table.to_pandas()
+        attrs = (table.schema.metadata or {}).get(b"attrs")
+        if attrs is not None:
+            data.attrs = json.loads(attrs)
+        return data
+
+    def load(self, filename, columns=None):
+        if self.format == "ipc":
+            with pa.memory_map(filename, "r") as source:
+                reader = pa.ipc.open_file(source)
+                table = reader.read_all()
+                columns = self._columns(table.schema, columns)
+                if columns is not None:
+                    table = table.select(columns)
+                return self._to_pandas(table)
+        else:
+            columns = self._columns(pq.read_schema(filename), columns)
+            table = pq.read_table(filename, columns=columns, memory_map=True)
+            return self._to_pandas(table)
+
+
+#:list: serializers used by default, the first one that accepts the data is used
+default_serializers = [ArrowSerializer(), PickleSerializer()]
+
+
+class _Stripe:
+    """ state of one lock file in this process """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.depth = 0
+        self.fd = None
+
+
+_stripes = {}
+_stripes_lock = threading.Lock()
+
+
+def _get_stripe(filename):
+    with _stripes_lock:
+        if filename not in _stripes:
+            _stripes[filename] = _Stripe()
+        return _stripes[filename]
+
+
+class FileLock:
+    """
+    Exclusive lock shared between processes (and threads)
+
+    Uses flock on POSIX systems and msvcrt.locking on Windows. The lock is
+    held on a separate lock file, which is never removed.
+
+    The lock is re-entrant for the thread that holds it, e.g. when a cached
+    function calls another cached function, whose entry uses the same lock
+    file. Other threads of the process wait on a thread lock, and only the
+    outermost acquire locks the file.
+    """
+
+    def __init__(self, filename):
+        self.filename = os.path.abspath(filename)
+        self._stripe = None
+
+    def _lock_file(self):
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        fd = os.open(self.filename, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            else:
+                while True:
+                    try:
+                        msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        # LK_LOCK gives up after 10 seconds
+                        continue
+        except BaseException:
+            os.close(fd)
+            raise
+        return fd
+
+    def _unlock_file(self, fd):
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(fd)
+
+    def acquire(self):
+        stripe = _get_stripe(self.filename)
+        stripe.lock.acquire()
+        if stripe.depth == 0:
+            try:
+                stripe.fd = self._lock_file()
+            except BaseException:
+                stripe.lock.release()
+                raise
+        stripe.depth += 1
+        self._stripe = stripe
+
+    def release(self):
+        stripe = self._stripe
+        if stripe is None:
+            return
+        self._stripe = None
+        try:
+            stripe.depth -= 1
+            if stripe.depth == 0:
+                fd, stripe.fd = stripe.fd, None
+                self._unlock_file(fd)
+        finally:
+            stripe.lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+def _hasher():
+    """ fast hash for cache keys, xxh3 if available """
+    if xxhash is not None:
+        return xxhash.xxh3_128()
+    return hashlib.blake2b(digest_size=16)
+
+
+def _update_hash(h, value):
+    """
+    Feed a canonical representation of value into the hash h
+
+    Numpy arrays and pandas objects are hashed from their data buffers,
+    instead of their (possibly truncated) string representation. Subclasses
+    of numpy arrays, like Quantity, are pickled to include e.g. their unit.
+    """
+    h.update(type(value).__name__.encode())
+    if isinstance(value, (list, tuple)):
+        h.update(b"[%d" % len(value))
+        for v in value:
+            _update_hash(h, v)
+        h.update(b"]")
+    elif isinstance(value, dict):
+        h.update(b"{%d" % len(value))
+        for k in sorted(value, key=repr):
+            _update_hash(h, k)
+            _update_hash(h, value[k])
+        h.update(b"}")
+    elif isinstance(value, (set, frozenset)):
+        h.update(b"{%d" % len(value))
+        for v in sorted(value, key=repr):
+            _update_hash(h, v)
+        h.update(b"}")
+    elif pd is not None and isinstance(value, (pd.DataFrame, pd.Series, pd.Index)):
+        if isinstance(value, pd.DataFrame):
+            _update_hash(h, list(value.columns))
+            _update_hash(h, [str(d) for d in value.dtypes])
+        else:
+            _update_hash(h, str(value.dtype))
+        try:
+            hashed = pd.util.hash_pandas_object(value, index=True).values
+            h.update(hashed.tobytes())
+        except TypeError:
+            # Unhashable elements, e.g. lists
+            h.update(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+    elif hasattr(value, "__array_interface__") and hasattr(value, "dtype"):
+        h.update(str(value.dtype).encode())
+        h.update(repr(value.shape).encode())
+        if np is not None and type(value) is not np.ndarray:
+            # Subclasses like Quantity or masked arrays carry more than their
+            # data, e.g. the unit, which has to be part of the key
+            try:
+                h.update(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+                return
+            except Exception:
+                _update_hash(h, str(getattr(value, "unit", "")))
+                value = np.asarray(value)
+        if value.dtype.hasobject:
+            _update_hash(h, value.tolist())
+        elif value.flags.c_contiguous:
+            try:
+                h.update(memoryview(value).cast("B"))
+            except (TypeError, ValueError):
+                # The buffer protocol does not support e.g. datetime64
+                h.update(value.tobytes())
+        else:
+            h.update(value.tobytes())
+    else:
+        h.update(repr(value).encode())
+
+
+def describe(value, limit=200):
+    """
+    Short human readable description of a cache key, for the manifest
+
+    Large objects like arrays and DataFrames are only described by their
+    type and shape.
+    """
+    if isinstance(value, (list, tuple)):
+        text = ", ".join(describe(v, limit) for v in value)
+    elif isinstance(value, dict):
+        text = ", ".join("%s=%s" % (k, describe(v, limit)) for k, v in value.items())
+    elif len(getattr(value, "shape", ())) > 0:
+        text = "<%s %s>" % (type(value).__name__, "x".join(str(n) for n in value.shape))
+    else:
+        text = str(value)
+    if len(text) > limit:
+        text = text[: limit - 3] + "..."
+    return text
+
+
+def make_key(func, args, kwargs, version=None, ignore=()):
+    """
+    Create a cache key for the call func(*args, **kwargs)
+
+    The arguments are bound to the signature of func, and defaults are
+    filled in, so that positional and keyword calls result in the same key.
+    The key is namespaced by the module and qualified name of func, and the
+    version (if given).
+
+    Parameters
+    ----------
+    func : callable
+        the called function
+    args : tuple
+        positional arguments
+    kwargs : dict
+        keyword arguments
+    version : str, optional
+        version of the function, change it to invalidate old entries
+    ignore : tuple, optional
+        names of arguments that are not part of the key, e.g. "self"
+
+    Returns
+    -------
+    namespace : str
+        namespace of the function
+    key : str
+        hex digest of the namespace and arguments
+    """
+    namespace = "%s.%s" % (func.__module__, func.__qualname__)
+    if version is not None:
+        namespace += ":%s" % version
+
+    h = _hasher()
+    h.update(namespace.encode())
+    for name, value in bind_arguments(func, args, kwargs, ignore).items():
+        h.update(name.encode())
+        _update_hash(h, value)
+    return namespace, h.hexdigest()
+
+
+def bind_arguments(func, args, kwargs, ignore=()):
+    """ bind the arguments to the signature of func, including defaults """
+    try:
+        bound = inspect.signature(func).bind(*args, **kwargs)
+        bound.apply_defaults()
+        arguments = bound.arguments
+    except (TypeError, ValueError):
+        # No signature available, e.g. for builtins
+        arguments = {"args": args, "kwargs": kwargs}
+    return {k: v for k, v in arguments.items() if k not in ignore}
+
+
+class NotFoundError(LookupError):
+    """ The data source has no data for the request """
+
+
+class NotFound:
+    """ Marker stored in the cache for requests without result """
+
+    def __init__(self, message=""):
+        self.message = message
+
+
+def is_empty(data):
+    """ whether data is an empty result, e.g. None, an empty DataFrame or dict """
+    if data is None:
+        return True
+    try:
+        return len(data) == 0
+    except TypeError:
+        return False
+
 
 class Cache:
-    def __init__(self, folder="~/.cache", *info):
+    def __init__(self, folder="~/.cache/data_sources", *info, namespace=None, description=None, ttl=None, negative_ttl=None, shared=False, serializers=None, codec=None):
+        """
+        Parameters
+        ----------
+        folder : str
+            cache folder
+        *info
+            anything that identifies the cached data, used to create the filename
+        namespace : str, optional
+            name of the data source that the entry belongs to
+        description : str, optional
+            human readable key of the entry in the manifest, by default
+            created from info
+        ttl : float, optional
+            lifetime of the entry in seconds, by default the one of the folder
+        negative_ttl : float, optional
+            lifetime of entries for requests without result, by default
+            cache_negative_ttl from the configuration, or one day
+        shared : bool, optional
+            if True, load does not copy the data kept in memory. Numpy
+            arrays, and the numpy data of DataFrames and astropy tables, are
+            read-only then. DataFrames and tables are returned as shallow
+            copies, so that changing their structure (e.g. adding a column)
+            does not affect other callers. Other objects are returned as they
+            are and must be treated as read-only. By default False.
+        serializers : list, optional
+            serializers to try in order, by default DataFrames are stored with
+            Arrow (if available) and everything else as pickle
+        codec : str, optional
+            compression of the entry, one of none, zlib, zstd, lz4. By default
+            the codec configured for the namespace (cache_codecs), or else
+            cache_codec from the configuration.
+        """
         self.folder = os.path.expanduser(folder)
         self.filename = self.createFilename(self.folder, info)
+        self.namespace = namespace
+        self.description = description if description is not None else describe(info)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl if negative_ttl is not None else _negative_ttl()
+        self.shared = shared
+        self.serializers = serializers if serializers is not None else default_serializers
+        if codec is None:
+            config = Config.get_config()
+            codec = (config.get("cache_codecs") or {}).get(namespace, config.get("cache_codec"))
+        self.codec = codec
+
+    @property
+    def manager(self):
+        return CacheManager.get(self.folder)
 
     def createFilename(self, folder, *info):
         # Create a file cashe to avoid using SIMBAD to much
@@ -17,38 +1183,467 @@ class Cache:
         filename = hashlib.sha224(string).hexdigest() + ".dat"
         return os.path.join(folder, filename)
 
-    def load(self):
+    def _path(self, serializer):
+        return os.path.splitext(self.filename)[0] + serializer.extension
+
+    def _find(self):
+        """ find the file of this entry, and the serializer that wrote it """
+        for serializer in self.serializers:
+            filename = self._path(serializer)
+            if os.path.exists(filename):
+                return serializer, filename
+        logging.info("No cached file found")
+        raise FileNotFoundError("File not found")
+
+    def load(self, columns=None):
+        """
+        Load the cached data
+
+        Parameters
+        ----------
+        columns : list, optional
+            only load these columns of a cached DataFrame
+
+        Raises
+        ------
+        FileNotFoundError
+            If there is no valid entry in the cache
+        NotFoundError
+            If the cache remembers that the data source has no data
+        """
+        return self._load_recorded(columns)
+
+    @property
+    def label(self):
+        """ namespace used in the statistics """
+        return self.namespace if self.namespace is not None else "default"
+
+    def _load_recorded(self, columns=None, count_miss=True):
+        """ load and record the hit or miss in the statistics of the folder """
+        start = time.perf_counter()
+        try:
+            data, filename, tier, nbytes = self._load(columns)
+        except FileNotFoundError:
+            if count_miss:
+                self.manager.stats.miss(self.label)
+            raise
+        seconds = time.perf_counter() - start
+        if isinstance(data, NotFound):
+            self.manager.stats.hit(self.label, filename, "negative", nbytes, seconds)
+            raise NotFoundError(data.message)
+        self.manager.stats.hit(self.label, filename, tier, nbytes, seconds)
+        return data
+
+    def _load(self, columns=None):
+        """ returns the data, the filename, the tier it came from and the bytes read """
+        serializer, filename = self._find()
+        try:
+            data = memory.get(filename)
+            if not self.manager.touch(filename):
+                memory.discard(filename)
+                self.manager.remove(filename)
+                raise FileNotFoundError("File expired")
+            tier, nbytes = "memory", 0
+        except KeyError:
+            tier, nbytes = "disk", os.path.getsize(filename)
+            if columns is not None:
+                # Partial loads are not kept in memory
+                return self._load_file(serializer, filename, columns), filename, tier, nbytes
+            data = _freeze(self._load_file(serializer, filename))
+            memory.put(filename, data)
+
+        if columns is not None:
+            data = data[list(columns)]
+        elif not self.shared:
+            # The object in memory has to stay untouched for the next call
+            data = copy.deepcopy(data)
+        else:
+            data = _view(data)
+        return data, filename, tier, nbytes
+
+    def _load_file(self, serializer, filename, columns=None):
+        if not self.manager.touch(filename):
+            logging.info("Cached file expired: %s" % filename)
+            self.manager.remove(filename)
+            raise FileNotFoundError("File expired")
+
         try:
-            with open(self.filename, "rb") as f:
-                return pickle.load(f)
-            logging.info("Cached file found: %s" % self.filename)
-        except (FileNotFoundError, ValueError):
+            data = serializer.load(filename, columns=columns)
+        except CodecUnavailableError as ex:
+            # The entry is fine, it was just written by someone with more codecs
+            logging.info("Can not read cached file %s: %s" % (filename, ex))
+            raise FileNotFoundError("File not readable")
+        except (FileNotFoundError, ValueError, EOFError, OSError):
             # The load will fail with a ValueError if the pickle version changed
             logging.info("No cached file found")
+            self.manager.remove(filename)
             raise FileNotFoundError("File not found")
+        logging.info("Cached file found: %s" % filename)
+        return data
+
+    def save(self, data, ttl=None):
+        """
+        Store data in the cache
 
-    def save(self, data):
+        The data is written to a temporary file first, which is then moved in
+        place, so that other processes never read a partially written file.
+        """
+        start = time.perf_counter()
         os.makedirs(self.folder, exist_ok=True)
-        with open(self.filename, "wb") as f:
-            pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
-            logging.info("Data cached at: %s" % self.filename)
-        # data.to_pickle(self.filename)
+        for serializer in self.serializers:
+            if not serializer.accepts(data):
+                continue
+            filename = self._path(serializer)
+            fd, tmp = tempfile.mkstemp(
+                dir=self.folder, prefix=os.path.basename(filename), suffix=".tmp"
+            )
+            os.close(fd)
+            try:
+                serializer.dump(data, tmp, codec=self.codec)
+                os.replace(tmp, filename)
+                break
+            except Exception as ex:
+                logging.info("Could not store data with %s: %s" % (type(serializer).__name__, ex))
+                os.remove(tmp)
+        else:
+            raise TypeError("No serializer accepts data of type %s" % type(data))
+        logging.info("Data cached at: %s" % filename)
+
+        # Remove versions of this entry in other formats
+        for other in self.serializers:
+            if other is not serializer:
+                memory.discard(self._path(other))
+                if os.path.exists(self._path(other)):
+                    self.manager.remove(self._path(other))
+        memory.discard(filename)
+        size = os.path.getsize(filename)
+        max_bytes = self.manager.max_bytes
+        if max_bytes is not None and size > max_bytes:
+            # It would push out everything else, and still not fit
+            logging.warning(
+                "Not caching %s, its size (%i bytes) exceeds the budget of the cache folder (%i bytes)"
+                % (self.description, size, max_bytes)
+            )
+            self.manager.remove(filename)
+            return
+        self.manager.register(
+            filename, ttl if ttl is not None else self.ttl, self.namespace, self.description
+        )
+        seconds = time.perf_counter() - start
+        self.manager.stats.save(self.label, size, seconds)
+
+    def save_not_found(self, message=""):
+        """
+        Remember that the data source has no data for this request
+
+        The entry only lives for negative_ttl seconds, and load raises a
+        NotFoundError until then. Transient failures, like timeouts, should
+        not be stored this way.
+        """
+        self.save(NotFound(message), ttl=self.negative_ttl)
+
+    def lock(self):
+        """
+        Lock on this entry, shared between processes
+
+        The lock files are striped over 4096 files in the .locks subfolder,
+        so that they do not accumulate.
+        """
+        key = os.path.basename(self.filename)[:3]
+        return FileLock(os.path.join(self.folder, ".locks", key + ".lock"))
+
+    def load_or_create(self, func, *args, **kwargs):
+        """
+        Load the cached data, or create it with func(*args, **kwargs) and
+        store it, if it is not cached yet.
+
+        Only one process creates the data at a time, all others that miss the
+        same entry wait for it and then load the result from the cache.
+
+        Empty results are only kept for negative_ttl seconds. If func raises
+        a NotFoundError, that is remembered for the same time as well.
+        """
+        try:
+            return self.load()
+        except FileNotFoundError:
+            pass
+
+        with self.lock():
+            # Someone else might have created it, while we waited for the lock
+            try:
+                return self._load_recorded(count_miss=False)
+            except FileNotFoundError:
+                pass
+            try:
+                data = func(*args, **kwargs)
+            except NotFoundError as ex:
+                self.save_not_found(str(ex))
+                raise
+            self.save(data, ttl=self.negative_ttl if is_empty(data) else None)
+        return data
 
 
 class UseCache:
-    def __init__(self, folder="~/.cache"):
+    """
+    Decorator that caches the results of a function
+
+    The cache key is created by make_key, i.e. from the arguments bound to
+    the signature of the function, namespaced by its module, name and version.
+    """
+
+    def __init__(self, folder="~/.cache/data_sources", ttl=None, negative_ttl=None, shared=False, version=None, ignore=()):
         self.folder = folder
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl if negative_ttl is not None else _negative_ttl()
+        self.shared = shared
+        self.version = version
+        self.ignore = ignore
 
     def __call__(self, func):
         @wraps(func)
         def wrapper(*args, **kwargs):
-            cache = Cache(self.folder, *args, *kwargs.values())
-            try:
-                data = cache.load()
-            except FileNotFoundError:
-                data = func(*args, **kwargs)
-                cache.save(data)
-            finally:
-                return data
+            namespace, key = make_key(func, args, kwargs, version=self.version, ignore=self.ignore)
+            description = describe(bind_arguments(func, args, kwargs, self.ignore))
+            cache = Cache(
+                self.folder, key, namespace=namespace, description=description,
+                ttl=self.ttl, negative_ttl=self.negative_ttl, shared=self.shared,
+            )
+            return cache.load_or_create(func, *args, **kwargs)
 
         return wrapper
+
+
+def report(folder=None, n_keys=10):
+    """
+    Summary of the cache statistics of a folder, as text
+
+    Parameters
+    ----------
+    folder : str, optional
+        cache folder, by default path_cache from the configuration
+    n_keys : int, optional
+        number of hot keys to list, by default 10
+    """
+    if folder is None:
+        folder = Config.get_config()["path_cache"]
+    manager = CacheManager.get(folder)
+    stats = manager.load_stats()
+
+    def ms(seconds):
+        return "-" if seconds is None else "%.2f" % (seconds * 1000)
+
+    lines = [
+        "Cache folder: %s" % manager.folder,
+        "Total size: %.1f MB" % (manager.total_size() / 1e6),
+        "",
+        "%-30s %8s %8s %8s %8s %6s %10s %10s %9s %9s %9s"
+        % ("namespace", "mem hit", "disk hit", "neg hit", "miss", "rate", "read [MB]", "write [MB]", "load p50", "load p99", "save p50"),
+    ]
+    for namespace, values in sorted(stats.as_dict().items()):
+        hits = sum(values.get(k, 0) for k in ["memory_hits", "disk_hits", "negative_hits"])
+        total = hits + values.get("misses", 0)
+        load = values.get("load_latency", [])
+        save = values.get("save_latency", [])
+        lines.append(
+            "%-30s %8i %8i %8i %8i %6s %10.1f %10.1f %9s %9s %9s"
+            % (
+                namespace[-30:],
+                values.get("memory_hits", 0),
+                values.get("disk_hits", 0),
+                values.get("negative_hits", 0),
+                values.get("misses", 0),
+                "%.0f%%" % (100 * hits / total) if total > 0 else "-",
+                values.get("bytes_read", 0) / 1e6,
+                values.get("bytes_written", 0) / 1e6,
+                ms(CacheStats.percentile(load, 50)),
+                ms(CacheStats.percentile(load, 99)),
+                ms(CacheStats.percentile(save, 50)),
+            )
+        )
+    lines.append("(latencies in ms, upper bound of the histogram bucket)")
+
+    lines += ["", "Hot keys:"]
+    for filename, namespace, hits, size in manager.hot_keys(n_keys):
+        if not hits:
+            break
+        lines.append("%8i hits %10.1f kB  %-20s %s" % (hits, size / 1e3, namespace, filename))
+    return "\n".join(lines)
+
+
+def default_folders():
+    """
+    the existing cache folders that the data sources use by default
+
+    Besides path_cache of the configuration, these are the defaults of
+    SIMBAD, HEASARC and ESOArchive, and of the Cache class.
+    """
+    folders = [
+        Config.get_config()["path_cache"],
+        "~/.cache/data_sources",
+        "./DATA/SIMBAD/",
+        "~/.cache/HEASARC",
+        "/DATA/Cache/",
+    ]
+    result = []
+    for folder in folders:
+        folder = os.path.abspath(os.path.expanduser(folder))
+        if folder not in result and os.path.isdir(folder):
+            result.append(folder)
+    return result
+
+
+def _prewarmer(source, folder=None, instrument="HARPS"):
+    """
+    function that fills the cache of the given source for one target
+
+    Without a folder, each source uses its own default cache folder, so that
+    the entries are found by the normal calls later.
+    """
+    # Only pass the folder if it is given, to keep the default of the source
+    if source == "simbad_ids":
+        from . import SIMBAD
+
+        kwargs = {"cache_folder": folder} if folder is not None else {}
+        return lambda name: SIMBAD.Query_ID(name, **kwargs)
+    elif source == "heasarc":
+        from . import HEASARC
+
+        kwargs = {"folder": folder} if folder is not None else {}
+        return lambda name: HEASARC.getData("Position==%s" % name.replace(" ", "_"), **kwargs)
+    elif source == "eso":
+        from . import ESOArchive
+
+        kwargs = {"cache_folder": folder} if folder is not None else {}
+        return lambda name: ESOArchive.from_ESO_Archive(name, instrument, **kwargs)
+    elif source == "stellardb":
+        from .StellarDB import StellarDB
+
+        # The stellar db always uses path_cache
+        return StellarDB().load
+    raise ValueError("Unknown source %s" % source)
+
+
+def prewarm(targets, source, folder=None, instrument="HARPS"):
+    """
+    Fill the cache for a list of targets
+
+    Parameters
+    ----------
+    targets : list
+        names of the targets
+    source : str
+        one of simbad_ids, heasarc, eso, stellardb
+    folder : str, optional
+        cache folder, by default the one the source uses by default
+    instrument : str, optional
+        instrument for the eso source, by default HARPS
+
+    Returns
+    -------
+    failed : dict
+        the exception for every target that could not be loaded
+    """
+    load = _prewarmer(source, folder, instrument)
+    failed = {}
+    for i, name in enumerate(targets):
+        try:
+            load(name)
+            logging.info("Prewarmed %s (%i of %i)" % (name, i + 1, len(targets)))
+        except Exception as ex:
+            logging.warning("Could not prewarm %s: %s" % (name, ex))
+            failed[name] = ex
+    return failed
+
+
+def main(argv=None):
+    """ Command line interface to inspect the cache """
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect the data_sources cache")
+    parser.add_argument(
+        "--folder",
+        help="cache folder, by default path_cache from the configuration "
+        "(for prewarm the default folder of the source)",
+    )
+    parser.add_argument(
+        "--all",
+        action="store_true",
+        help="stats and list of all default cache folders of the data sources",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    stats = commands.add_parser("stats", help="hit/miss statistics by namespace")
+    stats.add_argument("-n", type=int, default=10, help="number of hot keys to list")
+    stats.add_argument("--reset", action="store_true", help="reset the statistics")
+
+    listing = commands.add_parser("list", help="list the cached entries")
+    listing.add_argument("pattern", nargs="?", help="glob pattern of the key, e.g. '*Trappist*'")
+    listing.add_argument("--namespace", help="only entries of this namespace")
+
+    purge = commands.add_parser("purge", help="remove cached entries")
+    purge.add_argument("pattern", nargs="?", help="glob pattern of the key, e.g. '*Trappist*'")
+    purge.add_argument("--namespace", help="only entries of this namespace")
+    purge.add_argument("--expired", action="store_true", help="only remove expired entries")
+
+    warm = commands.add_parser("prewarm", help="fill the cache for a list of targets")
+    warm.add_argument("targets", help="file with one target name per line")
+    warm.add_argument(
+        "--source", default="simbad_ids", choices=["simbad_ids", "heasarc", "eso", "stellardb"]
+    )
+    warm.add_argument("--instrument", default="HARPS", help="instrument for the eso source")
+
+    args = parser.parse_args(argv)
+    if args.all:
+        if args.folder is not None:
+            parser.error("--all and --folder can not be used together")
+        if args.command not in ["stats", "list"]:
+            parser.error("--all is only supported by stats and list")
+        folders = default_folders()
+    else:
+        folders = [args.folder or Config.get_config()["path_cache"]]
+    folder = folders[0] if len(folders) > 0 else None
+    manager = CacheManager.get(folder) if folder is not None else None
+
+    if args.command == "stats":
+        for i, folder in enumerate(folders):
+            if args.reset:
+                CacheManager.get(folder).reset_stats()
+            else:
+                print(("\n" if i > 0 else "") + report(folder, args.n))
+    elif args.command == "list":
+        for i, folder in enumerate(folders):
+            if args.all:
+                print(("\n" if i > 0 else "") + "Cache folder: %s" % folder)
+            print("%-20s %10s %-19s %-19s %6s  %s" % ("namespace", "size [kB]", "created", "last access", "hits", "key"))
+            for filename, namespace, key, size, created, last_access, hits in CacheManager.get(folder).entries(args.pattern, args.namespace):
+                print(
+                    "%-20s %10.1f %-19s %-19s %6i  %s"
+                    % (
+                        str(namespace)[-20:],
+                        size / 1e3,
+                        time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(created)),
+                        time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(last_access)),
+                        hits or 0,
+                        key if key is not None else filename,
+                    )
+                )
+    elif args.command == "purge":
+        if args.expired:
+            print("Removed %i entries" % manager.remove_expired())
+        elif args.pattern is None and args.namespace is None:
+            parser.error("purge requires a pattern, --namespace or --expired")
+        else:
+            n = manager.purge(args.pattern, args.namespace)
+            print("Removed %i entries" % n)
+    elif args.command == "prewarm":
+        with open(args.targets) as f:
+            targets = [line.strip() for line in f]
+        targets = [t for t in targets if t != "" and not t.startswith("#")]
+        failed = prewarm(targets, args.source, args.folder, args.instrument)
+        print("Prewarmed %i of %i targets" % (len(targets) - len(failed), len(targets)))
+        for name, ex in failed.items():
+            print("Failed: %s (%s)" % (name, ex))
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,7 @@ import pandas as pd
 import requests
 
 from . import Cache
+from . import Retry
 
 # http://archive.eso.org/cms/faq/how-do-i-programmatically-access-the-archive.html
 # http://archive.eso.org/cms/faq/how-do-i-submit-a-request-to-the-archive-programmatically.html
@@ -30,14 +31,17 @@ from . import Cache
 def from_ESO_Archive(star, instrument, cache_folder='/DATA/Cache/', UseCache=True):
     """ fetch data from ESO Archive """
 
-    cache = Cache.Cache(cache_folder, star, instrument)
+    cache = Cache.Cache(cache_folder, star, instrument, namespace='ESO')
     if UseCache:
-        data = cache.load()
-        print('Successfully loaded data for Star ', star)
-        return data
+        df = cache.load_or_create(query_ESO_Archive, star, instrument)
     else:
-        df = None
+        df = query_ESO_Archive(star, instrument)
+    print('Successfully loaded data for Star ', star)
+    return df
 
+
+def query_ESO_Archive(star, instrument):
+    """ send the query to the ESO Archive """
     host = "http://archive.eso.org/wdb/wdb/adp/phase3_spectral/query"
     # host = "http://archive.eso.org/wdb/wdb/eso/eso_archive_main/query"
     params = {
@@ -47,14 +51,11 @@ def from_ESO_Archive(star, instrument, cache_folder='/DATA/Cache/', UseCache=Tru
         'spectrum[]': instrument,
         'add': "((ins_id like '{}%'))".format(instrument)
     }
-    n_retries = 10
-    for i in range(n_retries):
-        try:
-            r = requests.get(host, params=params)
-            break
-        except requests.exceptions.ChunkedEncodingError as e:
-            print(e)
-            continue
+    policy = Retry.RetryPolicy(
+        "archive.eso.org",
+        retry_on=(requests.exceptions.ChunkedEncodingError, requests.exceptions.ConnectionError),
+    )
+    r = policy.call(requests.get, host, params=params)
 
     # Check if results are empty
     if 'No data returned !' in r.text:
@@ -67,19 +68,18 @@ def from_ESO_Archive(star, instrument, cache_folder='/DATA/Cache/', UseCache=Tru
     except pd.errors.ParserError:
         raise ValueError(r.text)
 
-    cache.save(df)
-    print('Successfully loaded data for Star ', star)
     return df
 
 
 def batch_from_ESO_Archive(stars, instrument, cache_folder='/DATA/Cache/', UseCache=False):
     """ fetch data for several stars at once"""
 
-    cache = Cache.Cache(cache_folder, stars, instrument)
-    data = cache.load() if UseCache else None
-
-    if data is not None:
-        return data
+    cache = Cache.Cache(cache_folder, stars, instrument, namespace='ESO')
+    if UseCache:
+        try:
+            return cache.load()
+        except FileNotFoundError:
+            pass
 
     is_first = True
     archive = None
@@ -12,7 +12,8 @@ import io
 import logging
 import re
 import socket
-import urllib
+import urllib.parse
+import urllib.request
 
 import pandas as pd
 
@@ -115,15 +116,14 @@ def getData(dataset, catalogue='exoplanodb', fields=('name', 'star_name', 'numbe
     if isinstance(dataset, str):
         dataset = (dataset, )
 
-    cache = Cache.Cache(folder, dataset, catalogue, fields, maxresults)
-    try:
-        data = cache.load() if UseCache else None
-    except FileNotFoundError:
-        data = None
+    cache = Cache.Cache(folder, dataset, catalogue, fields, maxresults, namespace='HEASARC')
+    if UseCache:
+        return cache.load_or_create(queryData, dataset, catalogue, fields, maxresults)
+    return queryData(dataset, catalogue, fields, maxresults)
 
-    if data is not None:
-        return data
 
+def queryData(dataset, catalogue, fields, maxresults):
+    """ get the data from HEASARC """
     logging.info('Getting data from HEASARC')
     df = pd.DataFrame(index=range(len(dataset)), columns=fields)
 
@@ -131,6 +131,9 @@ def getData(dataset, catalogue='exoplanodb', fields=('name', 'star_name', 'numbe
         obsids = heasarc(catalogue, source, fields=fields, max_results=maxresults)
         text = obsids.text
         lines = text.split('\n')
+        if '|' not in lines[0]:
+            # No table, i.e. nothing found for this query
+            raise Cache.NotFoundError(lines[0])
         endline = lines.index('')
         lines = lines[:endline]
         temp = ('{}\n' * len(lines))
@@ -141,6 +144,4 @@ def getData(dataset, catalogue='exoplanodb', fields=('name', 'star_name', 'numbe
     df = df.applymap(lambda s: s.decode('utf-8')
                      if isinstance(s, bytes) else s)
     # print(df.head())
-
-    cache.save(df)
     return df
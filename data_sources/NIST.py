@@ -6,7 +6,7 @@ import numpy as np
 import pandas as pd
 from astropy import units as q
 
-from .Cache import UseCache
+from .Cache import UseCache, NotFoundError
 
 @UseCache()
 def load(element, wmin, wmax, wunit="micrometer"):
@@ -14,7 +14,13 @@ def load(element, wmin, wmax, wunit="micrometer"):
     wmax = wmax * q.Unit(wunit).to(q.nanometer)
 
     nist = NISTLines(spectrum=element, lower_wavelength=wmin, upper_wavelength=wmax)
-    lines = nist.get_lines()
+    try:
+        lines = nist.get_lines()
+    except Exception as ex:
+        # nistasd raises a plain Exception if the element has no lines
+        if ex.args[:1] == ("NoASDlines",):
+            raise NotFoundError(f"No lines found for {element} in NIST ASD")
+        raise
     lines = pd.DataFrame.from_records(lines)
 
     # Select only lines within the desired window
@@ -20,6 +20,7 @@ import numpy as np
 
 from . import Cache
 from . import config
+from . import Retry
 
 def round_to(n, precision, limits=None, round_direction=None):
     """ Round to the closest value within the given precison or the next limit
@@ -165,32 +166,19 @@ class PSG:
         # curl --data-urlencode file@config.txt https://psg.gsfc.nasa.gov/api.php
 
         # curl -d type=trn -d whdr=n --data-urlencode file@config.txt https://psg.gsfc.nasa.gov/api.php
-        cache = Cache.Cache(self.cache_folder, str(self.psg_config), kwargs)
-        try:
-            data = cache.load() if UseCache else None
-        except FileNotFoundError:
-            data = None
-
-        if data is None:
-            print('Sending request to Planetary Spectrum Generator')
-            data = None
-            for _ in range(10):
-                try:
-                    data = self._curl(**kwargs)
-                    break
-                except:
-                    # Try again
-                    pass
-            if data is None:
-                raise RuntimeError("Could not load data from server")
-            # save data as cache
-            if UseCache:
-                cache.save(data)
-            print('... Done')
+        cache = Cache.Cache(self.cache_folder, str(self.psg_config), kwargs, namespace="PSG")
+        if UseCache:
+            # Only one process sends the request, the others wait for the cached result
+            data = cache.load_or_create(self._request, **kwargs)
         else:
-            pass
-            # print('Using cached PSG data')
+            data = self._request(**kwargs)
+        return data
 
+    def _request(self, **kwargs):
+        """ send the request to the server, with a few tries """
+        print('Sending request to Planetary Spectrum Generator')
+        data = Retry.RetryPolicy("psg.gsfc.nasa.gov").call(self._curl, **kwargs)
+        print('... Done')
         return data
 
     def __parse__(self, line):
@@ -0,0 +1,191 @@
+"""
+Retries and rate limits for requests to remote data sources
+
+All requests to the same host share one rate limit (a token bucket) and
+one retry budget, across all threads of the process. Failed requests are
+retried with exponential backoff and random jitter, so that many clients
+do not retry at the same moment. Once the retry budget is used up, failed
+requests are not retried anymore, until enough requests succeed again.
+
+Example
+-------
+>>> policy = RetryPolicy("simbad.cds.unistra.fr")
+>>> data = policy.call(Simbad.query_object, "Trappist-1")
+"""
+import logging
+import random
+import threading
+import time
+
+try:
+    from . import config as Config
+except ImportError:
+    import config as Config
+
+try:
+    from .Cache import NotFoundError
+except ImportError:
+    from Cache import NotFoundError
+
+
+class RetryError(RuntimeError):
+    """ A request still failed after all retries """
+
+
+class TokenBucket:
+    """
+    Rate limit, shared between threads
+
+    Every request takes a token. Tokens are refilled at a constant rate,
+    up to the capacity, which allows short bursts.
+    """
+
+    def __init__(self, rate, capacity=None):
+        """
+        Parameters
+        ----------
+        rate : float
+            tokens per second, None for no limit
+        capacity : float, optional
+            maximum number of tokens, by default max(1, rate)
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1, rate or 1)
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def acquire(self, tokens=1):
+        """ wait until there are enough tokens, and take them """
+        if self.rate is None:
+            return
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class RetryBudget:
+    """
+    Limits the number of retries, relative to the number of requests
+
+    Every request adds ratio to the budget, and every retry costs 1. The
+    budget is also refilled slowly over time (min_per_second), so that a
+    host that was down for a while can still be retried.
+    """
+
+    def __init__(self, ratio=0.2, min_per_second=0.1, capacity=10):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.capacity = capacity
+        self.balance = capacity
+        self.last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        """ record a request """
+        with self._lock:
+            self.balance = min(self.capacity, self.balance + self.ratio)
+
+    def withdraw(self):
+        """ take one retry from the budget, returns False if there is none left """
+        with self._lock:
+            now = time.monotonic()
+            self.balance = min(self.capacity, self.balance + (now - self.last) * self.min_per_second)
+            self.last = now
+            if self.balance < 1:
+                return False
+            self.balance -= 1
+            return True
+
+
+_hosts = {}
+_hosts_lock = threading.Lock()
+
+
+def get_host(host):
+    """ the rate limit and retry budget of a host, shared by the whole process """
+    with _hosts_lock:
+        if host not in _hosts:
+            config = Config.get_config()
+            rate = (config.get("rate_limits") or {}).get(host, config.get("rate_limit_default"))
+            budget = RetryBudget(ratio=config.get("retry_budget", 0.2))
+            _hosts[host] = (TokenBucket(rate), budget)
+        return _hosts[host]
+
+
+class RetryPolicy:
+    """
+    Send requests to a host, with rate limit, retries and backoff
+    """
+
+    def __init__(self, host, max_attempts=None, base_delay=None, max_delay=None, retry_on=(Exception,)):
+        """
+        Parameters
+        ----------
+        host : str
+            name of the host, requests to the same host share the rate limit and retry budget
+        max_attempts : int, optional
+            maximum number of tries per request, by default config "retry_max_attempts"
+        base_delay : float, optional
+            delay before the first retry in seconds, doubled for every further
+            retry, by default config "retry_base_delay"
+        max_delay : float, optional
+            maximum delay between tries in seconds, by default config "retry_max_delay"
+        retry_on : tuple, optional
+            exceptions that are retried, others are raised right away. A
+            NotFoundError is never retried. By default all exceptions.
+        """
+        config = Config.get_config()
+        self.host = host
+        self.max_attempts = max_attempts if max_attempts is not None else config.get("retry_max_attempts", 10)
+        self.base_delay = base_delay if base_delay is not None else config.get("retry_base_delay", 0.5)
+        self.max_delay = max_delay if max_delay is not None else config.get("retry_max_delay", 30)
+        self.retry_on = retry_on
+        self.limiter, self.budget = get_host(host)
+
+    def delay(self, attempt):
+        """ time to wait before the next try, with full jitter """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, func, *args, **kwargs):
+        """
+        call func(*args, **kwargs), and retry if it fails
+
+        Raises
+        ------
+        RetryError
+            if all tries failed, or the retry budget is used up
+        """
+        for attempt in range(self.max_attempts):
+            self.limiter.acquire()
+            if attempt == 0:
+                self.budget.deposit()
+            try:
+                return func(*args, **kwargs)
+            except NotFoundError:
+                raise
+            except self.retry_on as ex:
+                if attempt + 1 >= self.max_attempts:
+                    raise RetryError(
+                        "Request to %s failed after %i attempts: %r" % (self.host, attempt + 1, ex)
+                    ) from ex
+                if not self.budget.withdraw():
+                    raise RetryError(
+                        "Request to %s failed, and the retry budget is used up: %r" % (self.host, ex)
+                    ) from ex
+                delay = self.delay(attempt)
+                logging.warning(
+                    "Request to %s failed (%r), attempt %i of %i, retrying in %.1f s"
+                    % (self.host, ex, attempt + 1, self.max_attempts, delay)
+                )
+                time.sleep(delay)
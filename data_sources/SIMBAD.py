@@ -3,11 +3,17 @@ Load Data from SIMBAD DataBase
 """
 import logging
 
+import numpy as np
+import pandas as pd
 import astropy.io.votable as votable
 from astropy.table import Table
 from astroquery.simbad import Simbad
 
 from . import Cache
+from . import Retry
+
+#:int: number of objects sent to SIMBAD in one request
+BATCH_SIZE = 200
 
 
 def getNotes(starID):
@@ -19,8 +25,8 @@ def getNotes(starID):
     logging.warning('getNotes() does not currently do anything')
 
 
-def VOTableFromSimbad(stars, fields):
-    """ Load VOTable from SIMBAD """
+def SimbadClient(fields, ids=False):
+    """ Simbad object, that returns the given fields (and all identifiers if ids is True) """
     custom = Simbad()
     fields = [f.lower() for f in fields]
     if len(fields) > 0:
@@ -28,17 +34,173 @@ def VOTableFromSimbad(stars, fields):
             fields.remove('main_id')
         custom.remove_votable_fields('coordinates')
         custom.add_votable_fields(*fields)
+    if ids:
+        custom.add_votable_fields('ids')
+    return custom
+
+
+def VOTableFromSimbad(stars, fields):
+    """ Load VOTable from SIMBAD """
     # Some fields might be binary, need to be converted
     # This is done in DataFrameFromSimbad
-    return custom.query_object(makeStrList(stars, '\n', False))
+    return SimbadClient(fields).query_objects(list(stars))
+
+
+def findColumn(df, name):
+    """ name of a column, regardless of case (which differs between astroquery versions), or None """
+    for column in df.columns:
+        if column.lower() == name.lower():
+            return column
+    return None
+
+
+def splitByObject(table, stars):
+    """
+    Split the result of a multi object query into one row per object
+
+    Parameters
+    ----------
+    table : Table
+        result of query_objects(stars)
+    stars : list
+        names of the objects, in the order they were sent
+
+    Returns
+    -------
+    rows : dict
+        DataFrame with one row for each name, or None if SIMBAD does not know it
+    """
+    rows = {star: None for star in stars}
+    if table is None or len(table) == 0:
+        return rows
+    df = table.to_pandas()
+    df = df.applymap(lambda s: s.decode('utf-8') if type(s) == bytes else s)
+
+    # Newer versions of astroquery return the name, older ones the position
+    # in the script. Without either, all objects have to be found.
+    user_id = findColumn(df, 'user_specified_id')
+    script_id = findColumn(df, 'script_number_id')
+    if user_id is not None:
+        keys = list(df[user_id])
+    elif script_id is not None:
+        keys = [stars[int(i) - 1] for i in df[script_id]]
+    elif len(df) == len(stars):
+        keys = list(stars)
+    else:
+        raise ValueError('Can not assign the SIMBAD results to the objects')
+
+    main_id = findColumn(df, 'main_id')
+    for i, key in enumerate(keys):
+        if key not in rows or rows[key] is not None:
+            continue
+        if main_id is not None:
+            value = df[main_id].iloc[i]
+            # Objects that are not found have no main id
+            if value is None or value != value or value == '' or np.ma.is_masked(value):
+                continue
+        row = df.iloc[[i]].reset_index(drop=True)
+        if script_id is not None:
+            # The position in this request means nothing on its own
+            row = row.drop(columns=script_id)
+        rows[key] = row
+    return rows
+
+
+def batchFromSimbad(stars, fields=(), ids=False, chunksize=None, client=None, retry=None):
+    """
+    Query many objects, with one request per chunk of objects
+
+    Parameters
+    ----------
+    stars : list
+        names of the objects
+    fields : list, optional
+        votable fields to query, ignored if client is given
+    ids : bool, optional
+        also return all identifiers of the objects, separated by "|" in the
+        ids column, ignored if client is given. By default False.
+    chunksize : int, optional
+        number of objects per request, by default BATCH_SIZE
+    client : Simbad, optional
+        configured Simbad object to use, by default SimbadClient(fields, ids)
+    retry : Retry.RetryPolicy, optional
+        retry policy for the requests
+
+    Returns
+    -------
+    rows : dict
+        DataFrame with one row for each name, or None if SIMBAD does not know it
+    """
+    stars = list(dict.fromkeys(stars))
+    if client is None:
+        client = SimbadClient(fields, ids=ids)
+    if retry is None:
+        retry = Retry.RetryPolicy('simbad.cds.unistra.fr')
+    if chunksize is None:
+        chunksize = BATCH_SIZE
+
+    rows = {}
+    for i in range(0, len(stars), chunksize):
+        chunk = stars[i:i + chunksize]
+        logging.info('Querying %i objects from SIMBAD', len(chunk))
+        table = retry.call(client.query_objects, chunk)
+        rows.update(splitByObject(table, chunk))
+    return rows
+
+
+def joinRows(rows, stars):
+    """ one DataFrame of the rows of the objects, in the order of stars, skipping unknown objects """
+    rows = [rows[star] for star in dict.fromkeys(stars) if rows.get(star) is not None]
+    if len(rows) == 0:
+        return pd.DataFrame()
+    return pd.concat(rows, ignore_index=True)
 
 
 def DataFrameFromSimbad(stars, fields):
     """ Load DataFrama from SIMBAD """
-    vt = VOTableFromSimbad(stars, fields)
-    df = vt.to_pandas()
-    df = df.applymap(lambda s: s.decode('utf-8') if type(s) == bytes else s)
-    return df
+    return joinRows(batchFromSimbad(stars, fields), stars)
+
+
+def objectCache(cache_folder, star, fields):
+    """ cache entry of the data of a single object, for a set of fields """
+    fields = tuple(sorted(set(f.lower() for f in fields)))
+    return Cache.Cache(cache_folder, star, fields, 'object', namespace='SIMBAD')
+
+
+def cachedFromSimbad(stars, fields, cache_folder='./DATA/SIMBAD/', chunksize=None):
+    """
+    Load the rows of the objects from the cache, and query only the missing ones
+
+    Every object is cached on its own, so adding a star to a list of stars
+    only sends a request for the new star. Objects that SIMBAD does not know
+    are remembered for a while as well (see Cache.save_not_found).
+
+    Returns
+    -------
+    rows : dict
+        DataFrame with one row for each name, or None if SIMBAD does not know it
+    """
+    rows = {}
+    missing = []
+    for star in dict.fromkeys(stars):
+        try:
+            rows[star] = objectCache(cache_folder, star, fields).load()
+        except Cache.NotFoundError:
+            rows[star] = None
+        except FileNotFoundError:
+            missing.append(star)
+
+    if len(missing) > 0:
+        logging.info('Retrieving %i of %i objects from SIMBAD', len(missing), len(rows) + len(missing))
+        fetched = batchFromSimbad(missing, fields, chunksize=chunksize)
+        for star, row in fetched.items():
+            cache = objectCache(cache_folder, star, fields)
+            if row is None:
+                cache.save_not_found('%s not found in SIMBAD' % star)
+            else:
+                cache.save(row)
+        rows.update(fetched)
+    return rows
 
 
 def makeStrList(elements, seperator=', ', removeLastSeperator=True):
@@ -51,17 +213,11 @@ def makeStrList(elements, seperator=', ', removeLastSeperator=True):
 
 def Query_ID(name, cache_folder='./DATA/SIMBAD/', UseCache=True):
     """ query ids only """
-    cache = Cache.Cache(cache_folder, name, 'id_query')
-    try:
-        data = cache.load() if UseCache else None
-    except FileNotFoundError:
-        data = None
-
-    if data is not None:
-        return data
-    data = Simbad.query_objectids(name)
+    cache = Cache.Cache(cache_folder, name, 'id_query', namespace='SIMBAD')
     if UseCache:
-        cache.save(data)
+        data = cache.load_or_create(Simbad.query_objectids, name)
+    else:
+        data = Simbad.query_objectids(name)
 
     return data
 
@@ -69,26 +225,20 @@ def Query_ID(name, cache_folder='./DATA/SIMBAD/', UseCache=True):
 def getFromSimbad(stars, fields, table_format='pandas', cache_folder='./DATA/SIMBAD/', UseCache=True):
     """
     Manages the data retrieval and file cashe
+
+    Each object is cached separately, see cachedFromSimbad
     """
     logging.info('Loading SIMBAD data')
     # this needs working internet if the files arent there
     if isinstance(stars, str):  # make sure stars is a list
         stars = (stars,)
 
-    cache = Cache.Cache(cache_folder, stars, fields, format)
-    try:
-        data = cache.load() if UseCache else None
-    except FileNotFoundError:
-        data = None
-
-    if data is not None:
-        return data
+    if UseCache:
+        # if not cached get data online
+        df = joinRows(cachedFromSimbad(stars, fields, cache_folder), stars)
     else:
-        # if not get data online
         logging.info('Retrieving SIMBAD data online')
         df = DataFrameFromSimbad(stars, fields)
-        if UseCache:
-            cache.save(df)
 
     # return desired Format
     table_format = table_format.lower()
@@ -1,19 +1,21 @@
 """
 Handle the collection of yaml files known as stellar db
 """
+import hashlib
 import imp
 import inspect
 import os
+import re
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from string import ascii_lowercase
 import copy
 
 import astropy.units as u
 import astropy.coordinates as coords
-from astropy.time import Time
-from astropy.table import QTable
-
-import importlib
+from astropy.table import MaskedColumn, QTable, Table
 
 import numpy as np
 import pandas as pd
@@ -29,26 +31,111 @@ from astropy.io.misc import yaml
 from flex.flex import FlexFile
 
 try:
-    from . import Cache, config as Config
+    from . import (
+        Cache,
+        Retry,
+        SIMBAD,
+        StellarDBIndex,
+        StellarDBLayout,
+        StellarDBQuery,
+        StellarDBRecord,
+        StellarDBSpatial,
+        config as Config,
+    )
 except:
     import Cache
+    import Retry
+    import SIMBAD
+    import StellarDBIndex
+    import StellarDBLayout
+    import StellarDBQuery
+    import StellarDBRecord
+    import StellarDBSpatial
     import config as Config
 
 # TODO use json instead of yaml
 
 
+#:int: version of normalize_name, increase it when the normalization changes
+NORMALIZE_VERSION = 2
+#:tuple: prefixes of SIMBAD identifiers, that are not part of the name
+SIMBAD_PREFIXES = ("NAME ", "** ", "* ", "V* ", "EM* ")
+#:dict: different names of the same catalogue
+CATALOGUE_ALIASES = {"GL": "GJ", "GLIESE": "GJ", "HIPPARCOS": "HIP"}
+
+
+def normalize_name(name):
+    """
+    key of a star name in the name index
+
+    Ignores case and whitespace, as well as the SIMBAD prefixes (e.g. "NAME"
+    or "V*"), and uses the same catalogue name for catalogues with several
+    names, e.g. "Gl 581" and "GJ581" are the same. Hyphens between a catalogue
+    name and a number are ignored as well, e.g. "Trappist-1" and "TRAPPIST 1".
+    """
+    name = " ".join(str(name).split())
+    upper = name.upper()
+    for prefix in SIMBAD_PREFIXES:
+        if upper.startswith(prefix):
+            name = name[len(prefix):]
+            break
+    match = re.match(r"([A-Za-z]+)(?=[\s\d+-])\s*(.*)", name)
+    if match is not None and match.group(1).upper() in CATALOGUE_ALIASES:
+        name = CATALOGUE_ALIASES[match.group(1).upper()] + match.group(2)
+    name = re.sub(r"(?<=[A-Za-z])-(?=\d)", "", name)
+    return name.casefold().replace(" ", "")
+
+
+def fix_star(star):
+    """fix read object, to conform to standards"""
+    if isinstance(star["id"], str):
+        star["id"] = [
+            star["id"],
+        ]
+
+    return star
+
+
+def load_star(fname, lazy=False):
+    """
+    load the star data from a flex file
+
+    If lazy is True, a LazyRecord is returned, that only creates the astropy
+    objects of the values that are actually used.
+    """
+    if lazy:
+        return StellarDBRecord.LazyRecord(fix_star(StellarDBIndex.read_header(fname)))
+    ff = FlexFile.read(fname)
+    return fix_star(ff.header)
+
+
+def load_lazy_star(fname):
+    """load the star data from a flex file as LazyRecord"""
+    return load_star(fname, lazy=True)
+
+
 class StellarDB:
     """Class for handling stellar_db"""
 
-    def __init__(self, sources=None, regularize=True):
-        config = Config.load_config()
+    def __init__(self, sources=None, regularize=True, processes=None, chunksize=None, lazy=None):
+        config = Config.get_config()
         self.folder = config["path_stellar_db"]
         self.cache = config["path_cache"]
+        # Parallelism when reading many files, None reads them in this
+        # process and 0 uses all cores, see StellarDBIndex.parallel_map
+        self.processes = processes if processes is not None else config.get("stellardb_processes")
+        self.chunksize = chunksize if chunksize is not None else config.get("stellardb_chunksize")
+        # Only create the astropy objects of values that are used
+        self.lazy = lazy if lazy is not None else config.get("stellardb_lazy", False)
         self.name_index = self.gen_name_index()
         if sources is None:
             sources = ["exoplanets_org", "simbad", "exoplanets_nasa"]
         self.sources = sources
         self.regularize = regularize
+        self._data_sources = None
+        self._table = None
+        self._spatial_index = None
+        self._lock = threading.RLock()
 
     def __load_yaml__(self, fname):
         """load yaml data from file with given filename"""
@@ -61,51 +148,204 @@ class StellarDB:
             yaml.dump(data, fp, default_flow_style=False)
 
     def load_flex(self, fname):
-        ff = FlexFile.read(fname)
-        return self._fix(ff.header)
+        return load_star(fname, lazy=self.lazy)
 
     def write_flex(self, fname, data):
-        ff = Flexfile(header=data)
+        if isinstance(data, StellarDBRecord.LazyRecord):
+            data = data.to_dict()
+        ff = FlexFile(header=data)
         ff.write(fname)
 
     def load_layout(self, name):
         fname = os.path.join(os.path.dirname(__file__), f"layout_{name.lower()}.yaml")
         return self.__load_yaml__(fname)
 
-    def gen_name_index(self):
-        """index all names to files containing them"""
-        list_of_files = [
+    def gen_name_index(self, force=False):
+        """
+        index all names to files containing them
+
+        The index is persistent, and only new or modified files are read.
+        The folder is only scanned if files were added or removed since the
+        last update, files modified in place are found when they are loaded,
+        or by refresh(). Use force=True to read all files again.
+        """
+        name_index = StellarDBIndex.NameIndex(
+            self.folder, self.cache, normalize=normalize_name, normalize_version=NORMALIZE_VERSION
+        )
+        if force:
+            name_index.update(self._read_ids, force=True)
+        else:
+            name_index.update_if_changed(self._read_ids)
+        return name_index
+
+    def _read_ids(self, filenames):
+        """read the list of ids from each file, in parallel"""
+        return StellarDBIndex.parallel_map(
+            StellarDBIndex.read_ids, filenames, self.processes, self.chunksize
+        )
+
+    def preload_aliases(self, cache_folder="./DATA/SIMBAD/"):
+        """
+        add the ids of all cached SIMBAD.Query_ID results to the name index
+
+        For every cached result, that contains a name of a star in the
+        database, all of its ids become aliases of that star. This does not
+        require network access.
+
+        Parameters
+        ----------
+        cache_folder : str, optional
+            cache folder of Query_ID, by default "./DATA/SIMBAD/"
+
+        Returns
+        -------
+        n : int
+            number of stars that received aliases
+        """
+        cache_folder = os.path.expanduser(cache_folder)
+        if not os.path.exists(cache_folder):
+            return 0
+        manager = Cache.CacheManager.get(cache_folder)
+        n = 0
+        for entry in manager.entries("*, id_query", "SIMBAD"):
+            try:
+                data = manager.read(entry[0])
+            except FileNotFoundError:
+                continue
+            if isinstance(data, Cache.NotFound) or data is None or len(data) == 0:
+                continue
+            ids = [s.decode() if isinstance(s, bytes) else str(s) for s in data["ID"]]
+            for name in ids:
+                if name in self.name_index:
+                    self.name_index.add_aliases(self.name_index[name], ids)
+                    n += 1
+                    break
+        return n
+
+    def list_files(self):
+        """all flex files in the database"""
+        return [
             os.path.join(self.folder, x)
             for x in os.listdir(self.folder)
             if x.endswith(".flex")
         ]
 
-        cache = Cache.Cache(self.cache, *list_of_files)
-        try:
-            data = cache.load()
-        except FileNotFoundError:
-            data = None
+    def load_all(self, raw=False):
+        """
+        load all stars in the database, parsing the files in parallel
 
-        if data is not None:
-            return data
+        Parameters
+        ----------
+        raw : bool, optional
+            if True, return the headers as plain json, without converting
+            them to astropy objects, which is much faster. By default False.
+            Otherwise the stars are LazyRecords if the database is lazy.
+
+        Returns
+        -------
+        stars : dict
+            star data by filename
+        """
+        filenames = self.list_files()
+        if raw:
+            func = StellarDBIndex.read_header
+        else:
+            func = load_lazy_star if self.lazy else load_star
+        stars = StellarDBIndex.parallel_map(func, filenames, self.processes, self.chunksize)
+        return dict(zip(filenames, stars))
 
-        name_index = {}
-        for entry in list_of_files:
-            star = self.load_flex(entry)
-            name_list = star["id"] if isinstance(star["id"], list) else (star["id"],)
-            for name in name_list:
-                name = name.replace(" ", "")
-                name_index[name] = entry
+    def table(self, update=True):
+        """
+        columnar tables of all stars and planets in the database, for queries
 
-        cache.save(name_index)
-        return name_index
+        The tables are cached, and only files that changed since the last
+        call are read again. See StellarDBQuery.StarTable.
+
+        Parameters
+        ----------
+        update : bool, optional
+            check the folder for changes, by default True
+        """
+        with self._lock:
+            if self._table is None:
+                self._table = StellarDBQuery.StarTable(
+                    self.folder, self.cache, self.processes, self.chunksize
+                )
+                self.name_index.update(self._read_ids)
+                self._table.update(self.name_index.files())
+            elif update:
+                # The table compares the files itself, so it also picks up
+                # files that the name index found in check_file
+                self.name_index.update(self._read_ids)
+                self._table.update(self.name_index.files())
+            return self._table
+
+    def refresh(self):
+        """
+        check the folder for files that were added, removed or modified by
+        other processes, and update the name index, the tables and the
+        spatial index
+
+        Files saved through this object are picked up without a refresh.
+
+        Returns
+        -------
+        table : StarTable
+            the updated tables
+        """
+        return self.table(update=True)
+
+    def spatial_index(self, update=False):
+        """
+        spatial index of the positions of all stars, see StellarDBSpatial
+
+        Parameters
+        ----------
+        update : bool, optional
+            check the folder for changes first, by default False. Scanning
+            the folder takes much longer than the search itself, use
+            refresh() after other processes changed the database.
+        """
+        with self._lock:
+            table = self.table(update=update)
+            if self._spatial_index is None:
+                self._spatial_index = StellarDBSpatial.SpatialIndex(table)
+            return self._spatial_index
+
+    def cone_search(self, ra, dec, radius, update=False):
+        """
+        all stars within radius of a position
+
+        Parameters
+        ----------
+        ra, dec : Quantity, float
+            position, floats are in degrees
+        radius : Quantity, float
+            search radius, floats are in degrees
+        update : bool, optional
+            check the folder for changes first, by default False, see refresh()
+
+        Returns
+        -------
+        stars : DataFrame
+            the stars (indexed by filename), with their separation in degrees
+        """
+        return self.spatial_index(update=update).cone_search(ra, dec, radius)
+
+    def nearest(self, ra, dec, k=1, update=False):
+        """the k stars closest to a position, see cone_search"""
+        return self.spatial_index(update=update).nearest(ra, dec, k=k)
 
-    def load(self, name, auto_get=True):
+    def load(self, name, auto_get=True, update=True):
         """
         load data for a given name
         if auto_get == True, then get info from the web if no file exists
+        if update == True, look for new files in the folder if the name is unknown
         """
-        name = name.replace(" ", "")
+        # The name index normalizes the names
+        if update and name not in self.name_index:
+            # Files might have been added since the index was opened
+            self.name_index.update_if_changed(self._read_ids)
         if name not in self.name_index:
             if auto_get:
                 print("Name %s not found, retrieving info online" % name)
@@ -115,35 +355,39 @@ class StellarDB:
 
         filename = self.name_index[name]
         star = self.load_flex(filename)
+        # Pick up the ids of files that were modified in place
+        if self.name_index.check_file(filename, lambda filenames: [list(star["id"])]):
+            with self._lock:
+                if self._table is not None:
+                    self._table.update_files([filename])
 
         return star
 
     def save(self, star):
         """save data for star with given name"""
         name = star["id"][0].replace(" ", "")
-        if name not in self.name_index:
-            print(f"WARNING: Name {name} not found, creating new entry")
-            filename = name + ".flex"
-            i = 1
-            while os.path.exists(os.path.join(self.folder, filename)):
-                filename = name + i + ".flex"
-                i += 1
-            filename = os.path.join(self.folder, filename)
-            self.name_index[name] = filename
-        else:
-            filename = self.name_index[name]
+        # Several threads may save at the same time, see auto_fill_many
+        with self._lock:
+            if name not in self.name_index:
+                print(f"WARNING: Name {name} not found, creating new entry")
+                filename = name + ".flex"
+                i = 1
+                while os.path.exists(os.path.join(self.folder, filename)):
+                    filename = name + str(i) + ".flex"
+                    i += 1
+                filename = os.path.join(self.folder, filename)
+            else:
+                filename = self.name_index[name]
 
-        ff = FlexFile(header=star)
-        ff.write(filename)
+            self.write_flex(filename, star)
+            # Update the index right away, with all names of the star
+            self.name_index.update_file(filename, [str(s) for s in star["id"]])
+            if self._table is not None:
+                self._table.update_files([filename])
 
     def _fix(self, star):
         """fix read object, to conform to standards"""
-        if isinstance(star["id"], str):
-            star["id"] = [
-                star["id"],
-            ]
-
-        return star
+        return fix_star(star)
 
     def to_base_type(self, value):
         if isinstance(value, np.str_):
@@ -190,27 +434,42 @@ class StellarDB:
             else:
                 target[k] = copy.copy(v)
 
-    def auto_fill(self, name):
+    @property
+    def data_sources(self):
+        """the data sources used by auto_fill, created once and shared by all calls"""
+        with self._lock:
+            if self._data_sources is None:
+                sources = {}
+                if "simbad" in self.sources:
+                    sources["simbad"] = StellarDB_Simbad()
+                if "exoplanets_org" in self.sources:
+                    sources["exoplanets_org"] = StellarDB_ExoplanetsOrg()
+                if "exoplanets_nasa" in self.sources:
+                    sources["exoplanets_nasa"] = StellarDB_ExoplanetsNasa(
+                        regularize=self.regularize
+                    )
+                self._data_sources = sources
+            return self._data_sources
+
+    def auto_fill(self, name, update=True):
         """retrieve data from SIMBAD and ExoplanetDB and save it in file"""
         try:
-            star = self.load(name, auto_get=False)
+            star = self.load(name, auto_get=False, update=update)
         except AttributeError:
             star = {"id": [name]}
         # name = star["id"][0]
 
         # Load fields to read from Database
-        sources = {}
-        if "simbad" in self.sources:
-            sources["simbad"] = StellarDB_Simbad()
-        if "exoplanets_org" in self.sources:
-            sources["exoplanets_org"] = StellarDB_ExoplanetsOrg()
-        if "exoplanets_nasa" in self.sources:
-            sources["exoplanets_nasa"] = StellarDB_ExoplanetsNasa(regularize=self.regularize)
-
-        data = {}
-        for id, source in sources.items():
-            data[id] = source.get(name)
-            self.deepupdate(star, data[id])
+        sources = self.data_sources
+
+        # The sources are independent, so we query them all at the same time
+        # but merge them in order, so that later sources take priority
+        with ThreadPoolExecutor(max_workers=max(1, len(sources))) as pool:
+            futures = {id: pool.submit(source.get, name) for id, source in sources.items()}
+            data = {}
+            for id, future in futures.items():
+                data[id] = future.result()
+                self.deepupdate(star, data[id])
 
         # Combine datasets
         # TODO: decide how to do this
@@ -228,9 +487,82 @@ class StellarDB:
         star["citation"] = np.unique(star["citation"])
 
         self.save(star)
+        return star
+
+    def auto_fill_many(self, names, max_workers=8):
+        """
+        retrieve data for many stars at once, see auto_fill
+
+        The stars are processed concurrently, and each star is saved as soon
+        as it is done. Errors of individual stars are reported, but do not
+        stop the others.
+
+        Parameters
+        ----------
+        names : list
+            names of the stars
+        max_workers : int, optional
+            maximum number of stars that are processed at the same time, by default 8
+
+        Returns
+        -------
+        failed : dict
+            the exception raised for each star that could not be filled
+        """
+        names = list(names)
+        failed = {}
+        # Look for new files once, and not again for every star, as the
+        # saves of the other threads change the folder all the time
+        self.name_index.update_if_changed(self._read_ids)
+        # Create the sources (and load the exoplanets.org table) only once
+        sources = self.data_sources
+        if "simbad" in sources:
+            # Query SIMBAD for all stars in a few large requests, instead of one per star
+            try:
+                sources["simbad"].prefetch(names)
+            except Exception as ex:
+                print(f"Could not prefetch SIMBAD data ({ex!r}), querying the stars one by one")
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = {pool.submit(self.auto_fill, name, update=False): name for name in names}
+            for i, future in enumerate(as_completed(futures)):
+                name = futures[future]
+                try:
+                    future.result()
+                    print(f"[{i + 1}/{len(names)}] {name}: done")
+                except Exception as ex:
+                    failed[name] = ex
+                    print(f"[{i + 1}/{len(names)}] {name}: failed ({ex!r})")
+        return failed
+
+
+#:dict: compiled layouts by name
+_plans = {}
 
 
 class StellarDB_DataSource:
+    #:str: namespace of the cache entries of this source
+    namespace = None
+
+    def not_found_cache(self, name):
+        """cache entry that remembers that name is not in this data source"""
+        # Called for every lookup, so use the configuration that is loaded once
+        folder = Config.get_config()["path_cache"]
+        return Cache.Cache(
+            folder, type(self).__name__, name, "not_found", namespace=self.namespace
+        )
+
+    def check_not_found(self, name):
+        """raise a NotFoundError if name is known to be missing in this data source"""
+        try:
+            self.not_found_cache(name).load()
+        except FileNotFoundError:
+            pass
+
+    def set_not_found(self, name, message):
+        """remember that name is missing in this data source, for a while"""
+        self.not_found_cache(name).save_not_found(message)
+
     def load_yaml(self, fname):
         """load yaml data from file with given filename"""
         with open(fname, "r") as fp:
@@ -240,6 +572,12 @@ class StellarDB_DataSource:
         fname = os.path.join(os.path.dirname(__file__), f"layout_{name.lower()}.yaml")
         return self.load_yaml(fname)
 
+    def load_plan(self, name):
+        """the compiled layout with the given name, see StellarDBLayout"""
+        if name not in _plans:
+            _plans[name] = StellarDBLayout.Plan(self.load_layout(name))
+        return _plans[name]
+
     def set_values(self, data, layout, skip_nan=True):
         """
         Fill the fields in layout, with data from data and keywords
@@ -248,96 +586,39 @@ class StellarDB_DataSource:
         ----------
         data : dict
             input data
-        layout : dict
-            target layout of the data
+        layout : dict, Plan
+            target layout of the data, compiled layouts are much faster
         """
+        if not isinstance(layout, StellarDBLayout.Plan):
+            layout = StellarDBLayout.Plan(layout)
+        return layout.apply(data, skip_nan=skip_nan)
 
-        result = {}
-
-        for key, value in layout.items():
-            if key.startswith("__"):
-                continue
-            if "name" in value:
-                unit = value.get("unit", None)
-                name = value["name"]
-                try:
-                    ref = data[value["ref"]]
-                except KeyError:
-                    ref = None
-
-                try:
-                    unc = value["unc"]
-                    unc = (data[unc[0]], data[unc[1]])
-                except KeyError:
-                    unc = None
-
-                try:
-                    value = data[name]
-                except KeyError:
-                    # Skip missing data
-                    continue
-
-                # Extract data from structures if necessary
-                if hasattr(value, "array"):
-                    # Pandas array
-                    value = value.array[0]
-                elif hasattr(value, "unmasked"):
-                    # Astropy Masked Quantity
-                    value = value.unmasked
-
-                if isinstance(value, bytes):
-                    value = value.decode()
-
-                if skip_nan and (
-                    value is None or value != value or np.ma.is_masked(value)
-                ):
-                    # Skip bad values
-                    # value != value == nan
-                    continue
-
-                # Apply the correct units
-                if unit is None or unit == "str":
-                    pass
-                elif unit == "hourangle":
-                    value = coords.Angle(value, u.hourangle)
-                elif unit == "deg" and isinstance(value, str):
-                    value = coords.Angle(value, u.deg)
-                elif unit == "jd":
-                    value = Time(value, format=unit)
-                else:
-                    value = value << u.Unit(unit)
+    def set_values_table(self, table, layout, rows=None, skip_nan=True):
+        """
+        Fill the fields in layout, for all rows of the table at once
 
-                # Apply Meta information
-                try:
-                    if value.info.meta is None:
-                        value.info.meta = {}
-                    if ref is not None:
-                        value.info.meta["reference"] = ref
-                    if unc is not None:
-                        value.info.meta["uncertainty"] = unc
-                except:
-                    pass
-
-                # Store data
-                result[key] = value
-
-            elif "__class__" in value:
-                # If we provide a class use that
-                # The input to the constructor are the specified values
-                module = value["__module__"]
-                cls = value["__class__"]
-                module = importlib.import_module(module)
-                module = getattr(module, cls)
-                layout2 = {k: v for k, v in layout[key].items() if k != "class"}
-                value = self.set_values(data, layout2)
-                result[key] = module(**value)
-            else:
-                result[key] = self.set_values(data, layout[key])
+        Parameters
+        ----------
+        table : QTable, DataFrame
+            input data
+        layout : dict, Plan
+            target layout of the data
+        rows : array, optional
+            only use these rows of the table, by default all rows
 
-        return result
+        Returns
+        -------
+        results : list
+            the filled layout for each row
+        """
+        if not isinstance(layout, StellarDBLayout.Plan):
+            layout = StellarDBLayout.Plan(layout)
+        return layout.apply_table(table, rows=rows, skip_nan=skip_nan)
 
 
 class StellarDB_Simbad(StellarDB_DataSource):
+    namespace = "SIMBAD"
+
     def __init__(self):
         self.fields = [
             "ra",
@@ -362,7 +643,13 @@ class StellarDB_Simbad(StellarDB_DataSource):
             "flux(K)",
         ]
         self.timeout = 10
+        self.retry = Retry.RetryPolicy("simbad.cds.unistra.fr", max_attempts=self.timeout)
+        self._client = None
+        self._client_lock = threading.Lock()
+        # Results of prefetch, that are not used yet
+        self._prefetched = {}
         self.layout = self.load_layout("simbad")
+        self.plan = self.load_plan("simbad")
         self.citation = [
             (
                 "Wenger, M., “The SIMBAD astronomical database. The "
@@ -372,53 +659,106 @@ class StellarDB_Simbad(StellarDB_DataSource):
             )
         ]
 
+    @property
+    def client(self):
+        """
+        SIMBAD client of this source, with its own votable fields
+
+        Unlike the global Simbad object, it is never reconfigured, so that
+        any number of threads can query it at the same time. It is created
+        on first use, since setting up the fields may need to ask the server.
+        """
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    client = Simbad()
+                    for f in self.fields + ["ids"]:
+                        try:
+                            client.add_votable_fields(f)
+                        except KeyError:
+                            print("No field named ", f, " found")
+                    self._client = client
+        return self._client
+
     def get(self, name):
-        # SIMBAD Data
-        for f in self.fields:
-            try:
-                Simbad.add_votable_fields(f)
-            except KeyError:
-                print("No field named ", f, " found")
+        # Don't ask again for stars that SIMBAD does not know
+        self.check_not_found(name)
 
-        simbad_data = None
-        for i in range(self.timeout):
-            try:
-                simbad_data = Simbad.query_object(name)
-                break
-            except Exception:
-                print(f"Connection failed, attempt {i} of {self.timeout}")
-                continue
+        data = self._prefetched.pop(name, None)
+        if data is None:
+            data = self.get_many([name]).get(name)
+        if data is None:
+            raise Cache.NotFoundError(f"Star name {name} not found in SIMBAD")
+        return data
 
-        # Reset the fileds, in case we run this several times
-        Simbad.reset_votable_fields()
-        if simbad_data is None:
-            raise RuntimeError("Star name not found or connection timed out")
+    def get_many(self, names, chunksize=None):
+        """
+        data of many stars, with one request per chunk of names
 
-        simbad_data = simbad_data.to_pandas()
-        simbad_data = simbad_data.applymap(
-            lambda s: s.decode("utf-8") if isinstance(s, bytes) else s
-        )
-        simbad_data["MAIN_ID"] = simbad_data["MAIN_ID"].apply(
-            lambda s: s.replace(" ", "")
+        The basic data and all identifiers of a star come in the same
+        request, see SIMBAD.batchFromSimbad.
+
+        Parameters
+        ----------
+        names : list
+            names of the stars
+        chunksize : int, optional
+            number of stars per request, by default SIMBAD.BATCH_SIZE
+
+        Returns
+        -------
+        data : dict
+            the data of each star, stars that SIMBAD does not know are left out
+        """
+        query = []
+        for name in names:
+            try:
+                self.check_not_found(name)
+                query.append(name)
+            except Cache.NotFoundError:
+                pass
+
+        rows = SIMBAD.batchFromSimbad(
+            query, chunksize=chunksize, client=self.client, retry=self.retry
         )
+        result = {}
+        for name, row in rows.items():
+            if row is None:
+                self.set_not_found(name, f"Star name {name} not found in SIMBAD")
+            else:
+                result[name] = self.convert(name, row)
+        return result
+
+    def prefetch(self, names, chunksize=None):
+        """query many stars at once, get returns their data without another request"""
+        self._prefetched.update(self.get_many(names, chunksize=chunksize))
+
+    def convert(self, name, simbad_data):
+        """the stellar db fields of one row of a SIMBAD result"""
+        main_id = SIMBAD.findColumn(simbad_data, "main_id")
+        if main_id is not None:
+            simbad_data[main_id] = simbad_data[main_id].apply(
+                lambda s: s.replace(" ", "")
+            )
+        ids = []
+        ids_column = SIMBAD.findColumn(simbad_data, "ids")
+        if ids_column is not None:
+            ids = [s for s in str(simbad_data[ids_column].iloc[0]).split("|") if s != ""]
         simbad_data = dict(simbad_data)
-        simbad_data = self.set_values(simbad_data, self.layout)
-        simbad_data["id"] = self.get_ids(name)
+        simbad_data = self.set_values(simbad_data, self.plan)
+        # To keep the order of elements
+        ids, ind = np.unique([name] + ids, return_index=True)
+        simbad_data["id"] = list(ids[np.argsort(ind)])
         simbad_data["citation"] = self.citation
         return simbad_data
 
     def get_ids(self, name):
         # Give it a few tries, just in case
-        ids = None
-        for i in range(self.timeout):
-            try:
-                ids = Simbad.query_objectids(name)
-                break
-            except Exception:
-                print(f"Connection failed, attempt {i}")
-                continue
-        if ids is None:
-            raise RuntimeError("Star name not found or connection timed out")
+        self.check_not_found(name)
+        ids = self.retry.call(self.client.query_objectids, name)
+        if ids is None or len(ids) == 0:
+            self.set_not_found(name, f"Star name {name} not found in SIMBAD")
+            raise Cache.NotFoundError(f"Star name {name} not found in SIMBAD")
 
         # To keep the order of elements
         star = {"name": [name]}
@@ -433,6 +773,7 @@ class StellarDB_ExoplanetsOrg(StellarDB_DataSource, ExoplanetOrbitDatabaseClass)
     def __init__(self):
         super().__init__()
         self.layout = self.load_layout("exoplanets_org")
+        self.plan = self.load_plan("exoplanets_org")
         self.citation = [
             (
                 "Han, E., “Exoplanet Orbit Database. II. Updates to "
@@ -441,69 +782,217 @@ class StellarDB_ExoplanetsOrg(StellarDB_DataSource, ExoplanetOrbitDatabaseClass)
             )
         ]
         self.EXOPLANETS_CSV_URL = "http://exoplanets.org/csv-files/exoplanets.csv"
+        # Only load the table once, even if several threads ask for it
+        self._table_lock = threading.Lock()
+        self._host_index = None
 
     def get_table(self, cache=True, show_progress=True, table_path=None):
         """We overwrite the get table method, since the original uses a horrbly slow
         implementation. We replace that with pandas. We also skip some minor steps that
         we dont need."""
+        with self._table_lock:
+            return self._get_table(cache, show_progress, table_path)
+
+    def checksum(self, fname):
+        """checksum of the content of a file"""
+        h = hashlib.sha256()
+        with open(fname, "rb") as f:
+            for chunk in iter(lambda: f.read(2**20), b""):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def parse_table(self, table_path):
+        """
+        read the csv table, and determine the units of its columns
+
+        Returns
+        -------
+        exoplanets_table : DataFrame
+            the table, with the additional column NAME_LOWERCASE. Missing
+            values of text columns are None.
+        units : dict
+            the units of the columns, that are known to astropy
+        """
+        # Pandas go brrrr
+        exoplanets_table = pd.read_csv(table_path, low_memory=False)
+        # pandas uses nan for missing strings, which Arrow can not store
+        for col in exoplanets_table.columns:
+            column = exoplanets_table[col]
+            if column.dtype == object:
+                exoplanets_table[col] = column.astype(object).where(column.notna(), None)
+
+        # Use numpy char arrays for efficiency
+        lowercase_names = exoplanets_table["NAME"].values.astype(str)
+        lowercase_names = np.char.lower(lowercase_names)
+        lowercase_names = np.char.replace(lowercase_names, " ", "")
+        exoplanets_table["NAME_LOWERCASE"] = lowercase_names
+
+        units = {}
+        for col in exoplanets_table.columns:
+            if col in self.param_units:
+                # Check that unit is implemented in this version of astropy
+                try:
+                    units[col] = u.Unit(self.param_units[col]).to_string()
+                except ValueError:
+                    print(f"WARNING: Unit {self.param_units[col]} not recognised")
+        return exoplanets_table, units
+
+    def build_table(self, exoplanets_table, units):
+        """
+        the QTable of the parsed table, with the units applied
+
+        The numeric columns are used without copying them, so a table that
+        was read from a memory mapped file stays memory mapped.
+        """
+        # Skip the sky coordinates, as we will do that later manually
+        # exoplanets_table['sky_coord'] = coords.SkyCoord(ra=exoplanets_table['RA'] * u.hourangle,
+        #                                          dec=exoplanets_table['DEC'] * u.deg)
+        columns = {}
+        for col in exoplanets_table.columns:
+            values = exoplanets_table[col].to_numpy()
+            if values.dtype == object:
+                # Text columns, like QTable.from_pandas
+                mask = pd.isna(values)
+                values = np.where(mask, "", values).astype(str)
+                if mask.any():
+                    values = MaskedColumn(values, mask=mask)
+            elif col in units:
+                values = u.Quantity(values, units[col], copy=False)
+            columns[col] = values
+        return QTable(columns, copy=False)
+
+    def load_table(self, table_path):
+        """
+        the final table and its host index, from the cache if possible
+
+        The parsed columns are cached as an Arrow file (with the units in its
+        metadata), which is memory mapped when it is read, and the QTable is
+        created from them without copying. The entries are specific to the
+        checksum of the csv file, so a new download creates new entries.
+
+        Returns
+        -------
+        table : QTable
+            the table, with units
+        host_index : dict
+            rows of the planets of each host, see index_hosts
+        """
+        folder = Config.get_config()["path_cache"]
+        checksum = self.checksum(table_path)
+        # Both are only read, so they can be shared with the memory cache
+        cache = Cache.Cache(
+            folder, type(self).__name__, "columns", checksum,
+            namespace="EXOPLANETS_ORG", shared=True,
+        )
+        cache_hosts = Cache.Cache(
+            folder, type(self).__name__, "hosts", checksum,
+            namespace="EXOPLANETS_ORG", shared=True,
+        )
+        try:
+            columns, host_index = cache.load(), cache_hosts.load()
+            return self.build_table(columns, columns.attrs["units"]), host_index
+        except FileNotFoundError:
+            pass
+        except Exception as ex:
+            print(f"WARNING: Could not read the cached exoplanets.org table ({ex!r})")
+
+        columns, units = self.parse_table(table_path)
+        columns.attrs["units"] = units
+        table = self.build_table(columns, units)
+        host_index = self.index_hosts(table)
+        cache.save(columns)
+        cache_hosts.save(host_index)
+        return table, host_index
+
+    def _get_table(self, cache, show_progress, table_path):
         if self._table is None:
             if table_path is None:
                 table_path = download_file(
                     self.EXOPLANETS_CSV_URL, cache=cache, show_progress=show_progress
                 )
-            # Pandas go brrrr
-            exoplanets_table = pd.read_csv(table_path, low_memory=False)
-
-            # Use numpy char arrays for efficiency
-            lowercase_names = exoplanets_table["NAME"].values.astype(str)
-            lowercase_names = np.char.lower(lowercase_names)
-            lowercase_names = np.char.replace(lowercase_names, " ", "")
-            exoplanets_table["NAME_LOWERCASE"] = lowercase_names
-
-            # convert the dataframe to a quantity table
-            exoplanets_table = QTable.from_pandas(exoplanets_table)
-            # Need to define the index
-            exoplanets_table.add_index("NAME_LOWERCASE")
-
-            # Create sky coordinate mixin column
-            # Skip the sky coordinates, as we will do that later manually
-            # exoplanets_table['sky_coord'] = coords.SkyCoord(ra=exoplanets_table['RA'] * u.hourangle,
-            #                                          dec=exoplanets_table['DEC'] * u.deg)
-            # Assign units to columns where possible
-            for col in exoplanets_table.columns:
-                if col in self.param_units:
-                    # Check that unit is implemented in this version of astropy
-                    try:
-                        exoplanets_table[col].unit = u.Unit(self.param_units[col])
-                    except ValueError:
-                        print(f"WARNING: Unit {self.param_units[col]} not recognised")
-
-            self._table = QTable(exoplanets_table)
+            self._table, self._host_index = self.load_table(table_path)
         return self._table
 
+    def query_planet(self, planet_name, *, table_path=None):
+        """the row of a planet, like the original, but without the table index"""
+        table = self.get_table(table_path=table_path)
+        names = np.asarray(table["NAME_LOWERCASE"]).astype(str)
+        rows = np.flatnonzero(names == self.normalize(planet_name))
+        if len(rows) == 0:
+            raise KeyError(planet_name)
+        return table[rows[0]] if len(rows) == 1 else table[rows]
+
+    @staticmethod
+    def normalize(name):
+        """key of a name in the table index, as used by query_planet"""
+        return name.strip().lower().replace(" ", "")
+
+    def index_hosts(self, table):
+        """
+        map the normalized name of each host star to the rows of its planets
+
+        The planet names are the host name followed by the planet letter,
+        and the rows of each host are sorted by letter.
+        """
+        names = np.asarray(table["NAME_LOWERCASE"]).astype(str)
+        letters = np.array([n[-1:] for n in names])
+        hosts = np.array([n[:-1] for n in names])
+        is_planet = np.isin(letters, list(ascii_lowercase[1:]))
+        rows = np.flatnonzero(is_planet)
+        rows = rows[np.lexsort((letters[rows], hosts[rows]))]
+        groups = pd.Series(rows).groupby(hosts[rows], sort=False).indices
+        return {host: rows[ind] for host, ind in groups.items()}
+
+    @property
+    def host_index(self):
+        """rows of the planets of each host, loaded together with the table"""
+        self.get_table()
+        return self._host_index
+
     def get(self, name):
         planets = {}
-        for comp in ascii_lowercase[1:]:
-            try:
-                exoplanet_data = self.query_planet(f"{name} {comp}")
-                exoplanet_data = self.set_values(exoplanet_data, self.layout)
-                exoplanet_data["planets"] = {comp: exoplanet_data["planets"]}
-                if comp == "b":
+        rows = self.host_index.get(self.normalize(name))
+        if rows is not None:
+            # All planets of the star at once
+            table = self.get_table()
+            letters = [n[-1] for n in np.asarray(table["NAME_LOWERCASE"][rows])]
+            for comp, exoplanet_data in zip(letters, self.set_values_table(table, self.plan, rows)):
+                if len(planets) == 0:
                     planets = exoplanet_data
+                    planets["planets"] = {comp: exoplanet_data["planets"]}
                 else:
-                    planets["planets"][comp] = exoplanet_data["planets"][comp]
-            except KeyError:
-                # Planet not found (and we don't expect any more)
-                break
+                    planets["planets"][comp] = exoplanet_data["planets"]
 
         planets["citation"] = self.citation
         return planets
 
 
 class StellarDB_ExoplanetsNasa(StellarDB_DataSource):
-    def __init__(self, regularize=True):
+    namespace = "NASA"
+    #:list: columns of the snapshot with names of the host star
+    alias_columns = ["hostname", "hd_name", "hip_name", "tic_id", "gaia_id"]
+
+    def __init__(self, regularize=True, bulk=None, offline=None, refresh=None):
+        """
+        Parameters
+        ----------
+        regularize : bool, optional
+            resolve aliases of the star name with the archive, by default True
+        bulk : bool, optional
+            answer queries from a local snapshot of the whole table instead
+            of one remote query per star, by default config "nasa_bulk"
+        offline : bool, optional
+            only use the local snapshot, never connect to the archive,
+            by default config "nasa_offline"
+        refresh : float, optional
+            age in seconds after which the snapshot is downloaded again,
+            by default config "nasa_refresh"
+        """
+        config = Config.get_config()
         self.timeout = 10
+        self.retry = Retry.RetryPolicy("exoplanetarchive.ipac.caltech.edu", max_attempts=self.timeout)
         self.layout = self.load_layout("exoplanets_nasa")
+        self.plan = self.load_plan("exoplanets_nasa")
         self.citation = [
             "This research has made use of the NASA Exoplanet "
             "Archive, which is operated by the California Institute of "
@@ -511,6 +1000,14 @@ class StellarDB_ExoplanetsNasa(StellarDB_DataSource):
             "Space Administration under the Exoplanet Exploration Program."
         ]
         self.regularize=regularize
+        self.table = "pscomppars"
+        self.offline = offline if offline is not None else config.get("nasa_offline", False)
+        self.bulk = self.offline or (bulk if bulk is not None else config.get("nasa_bulk", False))
+        self.refresh = refresh if refresh is not None else config.get("nasa_refresh")
+        self._snapshot = None
+        self._snapshot_time = None
+        self._host_index = None
+        self._snapshot_lock = threading.Lock()
 
     def tap(
         self, name, regularize=True, table="pscomppars"
@@ -518,34 +1015,125 @@ class StellarDB_ExoplanetsNasa(StellarDB_DataSource):
         query = NasaExoplanetArchive.query_object(name, regularize=regularize, table=table)
         return query
 
+    @staticmethod
+    def normalize(name):
+        """key of a name in the host index of the snapshot"""
+        return name.lower().replace(" ", "")
+
+    def snapshot_cache(self, *info):
+        folder = Config.get_config()["path_cache"]
+        return Cache.Cache(
+            folder, type(self).__name__, self.table, *info, namespace=self.namespace, shared=True
+        )
+
+    def download(self):
+        """download the whole table from the archive, as a DataFrame"""
+        table = NasaExoplanetArchive.query_criteria(table=self.table, select="*")
+        # Skip the sky_coord column, the coordinates are in ra and dec
+        names = [n for n in table.colnames if not isinstance(table[n], coords.SkyCoord)]
+        return Table(table[names]).to_pandas()
+
+    def refresh_snapshot(self):
+        """download the table again and store it in the cache"""
+        if self.offline:
+            raise RuntimeError("Can not refresh the NASA Exoplanet Archive snapshot in offline mode")
+        print("Downloading the NASA Exoplanet Archive table", self.table)
+        snapshot = self.download()
+        created = time.time()
+        self.snapshot_cache("snapshot").save(snapshot)
+        self.snapshot_cache("snapshot_time").save(created)
+        self._set_snapshot(snapshot, created)
+
+    def _set_snapshot(self, snapshot, created):
+        """use the snapshot and index the rows of each host star by all its names"""
+        hosts = {}
+        for i, host in enumerate(snapshot["hostname"]):
+            hosts.setdefault(host, []).append(i)
+
+        index = {}
+        for i, planet in enumerate(snapshot["pl_name"]):
+            index[self.normalize(planet)] = np.array([i])
+        columns = [c for c in self.alias_columns if c in snapshot]
+        for rows in hosts.values():
+            rows = np.array(rows)
+            for column in columns:
+                for alias in snapshot[column].values[rows]:
+                    if isinstance(alias, str) and alias != "":
+                        index[self.normalize(alias)] = rows
+
+        self._snapshot = snapshot
+        self._snapshot_time = created
+        self._host_index = index
+
+    def _load_snapshot(self):
+        """make sure we have an up to date snapshot, downloading it if necessary"""
+        with self._snapshot_lock:
+            if self._snapshot is None:
+                try:
+                    created = self.snapshot_cache("snapshot_time").load()
+                    self._set_snapshot(self.snapshot_cache("snapshot").load(), created)
+                except FileNotFoundError:
+                    if self.offline:
+                        raise RuntimeError(
+                            "No local snapshot of the NASA Exoplanet Archive available in offline mode"
+                        )
+
+            stale = (
+                self._snapshot is None
+                or self.refresh is not None
+                and time.time() - self._snapshot_time > self.refresh
+            )
+            if stale and not self.offline:
+                try:
+                    self.refresh_snapshot()
+                except Exception as ex:
+                    if self._snapshot is None:
+                        raise
+                    print(f"WARNING: Could not refresh the NASA Exoplanet Archive snapshot ({ex!r}), using the old one")
+
+    def query_local(self, name):
+        """all rows of the star in the snapshot, or None if it is not in there"""
+        self._load_snapshot()
+        rows = self._host_index.get(self.normalize(name))
+        if rows is None:
+            return None
+        return self._snapshot.iloc[rows].reset_index(drop=True)
+
+    def query_remote(self, name):
+        """query the rows of the star from the archive"""
+        return self.retry.call(
+            self.tap, name, regularize=self.regularize, table=self.table
+        )
+
     def get(self, name):
-        data = None
-        for i in range(self.timeout):
-            try:
-                data = self.tap(name, regularize=self.regularize)
-                break
-            except Exception:
-                print(f"Connection failed, attempt {i} of {self.timeout}")
-                continue
+        try:
+            self.check_not_found(name)
+        except Cache.NotFoundError:
+            return {}
 
+        data = None
+        if self.bulk:
+            data = self.query_local(name)
+            if data is None and (self.offline or not self.regularize):
+                data = []
         if data is None:
-            raise RuntimeError("Star name not found or connection timed out")
+            # Not in the snapshot under this name, but maybe as an alias
+            data = self.query_remote(name)
 
         if len(data) == 0:
             # No data found in the datatbase
+            self.set_not_found(name, f"Star name {name} not found in the NASA Exoplanet Archive")
             return {}
 
-        star_data = self.set_values(data[0], self.layout)
-        letter = data[0]["pl_letter"]
-        if isinstance(letter, bytes):
-            letter = letter.decode()
-        star_data["planets"] = {letter: star_data["planets"]}
-
-        for i in range(1, len(data)):
-            planet_letter = data[i]["pl_letter"]
-            if isinstance(planet_letter, bytes):
-                planet_letter = planet_letter.decode()
-            planet_data = self.set_values(data[i], self.layout)
+        # All planets at once
+        values = self.set_values_table(data, self.plan)
+        letters = [
+            s.decode() if isinstance(s, bytes) else s for s in np.asarray(data["pl_letter"])
+        ]
+
+        star_data = values[0]
+        star_data["planets"] = {letters[0]: star_data["planets"]}
+        for planet_letter, planet_data in zip(letters[1:], values[1:]):
             star_data["planets"][planet_letter] = planet_data["planets"]
 
         star_data["citation"] = self.citation
@@ -0,0 +1,351 @@
+"""
+Persistent index of the names in the flex files of the stellar db
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import tarfile
+import threading
+from collections.abc import MutableMapping
+from concurrent.futures import ProcessPoolExecutor
+
+
+def read_header(fname):
+    """
+    read the header of a flex file as plain json
+
+    Unlike FlexFile.read, this neither reads the extensions nor converts
+    the values into astropy objects, which makes it much faster.
+    """
+    with tarfile.open(fname, "r") as file:
+        return json.load(file.extractfile("header.json"))
+
+
+def read_ids(fname):
+    """read only the list of ids from a flex file"""
+    ids = read_header(fname)["id"]
+    return [ids] if isinstance(ids, str) else list(ids)
+
+
+def parallel_map(func, items, processes=None, chunksize=None, min_items=64):
+    """
+    Apply func to all items, using a process pool for many items
+
+    The pool is only used if processes is given explicitly. On platforms
+    that start the processes with spawn or forkserver (Windows, macOS, and
+    Linux from Python 3.14), the main module is imported again in every
+    process, so scripts have to guard their code with
+    ``if __name__ == "__main__":``.
+
+    Parameters
+    ----------
+    func : callable
+        function to apply, has to be picklable (i.e. defined on module level)
+    items : list
+        arguments of func, e.g. filenames
+    processes : int, optional
+        number of processes, 0 for the number of cores, by default (None)
+        the items are processed in this process
+    chunksize : int, optional
+        number of items sent to a process at a time, by default the items
+        are split into four chunks per process
+    min_items : int, optional
+        fewer items than this are processed in this process, by default 64
+
+    Returns
+    -------
+    results : list
+        func(item) for every item, in the same order
+    """
+    items = list(items)
+    if processes is None:
+        processes = 1
+    elif processes == 0:
+        processes = os.cpu_count() or 1
+    if processes <= 1 or len(items) < min_items:
+        return [func(item) for item in items]
+    if chunksize is None:
+        chunksize = max(1, len(items) // (4 * processes))
+    with ProcessPoolExecutor(processes) as pool:
+        return list(pool.map(func, items, chunksize=chunksize))
+
+
+class NameIndex(MutableMapping):
+    """
+    Maps the names of all stars in a stellar db folder to their flex files
+
+    For every file the modification time, size and the list of ids are
+    stored in an SQLite file in the cache folder. When the folder changes,
+    only new or modified files are parsed again, and lookups query the index
+    directly, so that opening a large database does not require reading it.
+
+    Every update compares the modification time and size of all files with
+    the index, which only needs a scan of the folder, so that files that are
+    modified in place are found as well. check_file does the same for a
+    single file, when it is loaded. update_if_changed skips the scan, as
+    long as the modification time of the folder is the same as at the last
+    update, i.e. no files were added, removed or renamed since then.
+
+    Besides the ids in the files, additional aliases of a star can be added
+    with add_aliases, e.g. from SIMBAD.
+    """
+
+    def __init__(self, folder, cache_folder, normalize=None, normalize_version=None):
+        """
+        Parameters
+        ----------
+        folder : str
+            stellar db folder with the flex files
+        cache_folder : str
+            folder for the index file
+        normalize : callable, optional
+            function that converts names into the keys of the index, by
+            default names are used as they are
+        normalize_version : int, optional
+            version of normalize, when it changes the keys of all names are
+            created again from the stored ids
+        """
+        self.folder = os.path.abspath(os.path.expanduser(folder))
+        key = hashlib.sha224(self.folder.encode()).hexdigest()[:16]
+        self.filename = os.path.join(os.path.expanduser(cache_folder), f"stellardb_{key}.sqlite")
+        self.normalize = normalize if normalize is not None else (lambda name: name)
+        self.normalize_version = normalize_version
+        self._lock = threading.RLock()
+        self._connection = None
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+            con = sqlite3.connect(self.filename, timeout=60, check_same_thread=False)
+            with con:
+                con.execute(
+                    "CREATE TABLE IF NOT EXISTS files ("
+                    "filename TEXT PRIMARY KEY, mtime INTEGER, size INTEGER, ids TEXT)"
+                )
+                con.execute(
+                    "CREATE TABLE IF NOT EXISTS names ("
+                    "name TEXT PRIMARY KEY, filename TEXT)"
+                )
+                con.execute("CREATE INDEX IF NOT EXISTS names_file ON names (filename)")
+                con.execute(
+                    "CREATE TABLE IF NOT EXISTS aliases ("
+                    "name TEXT PRIMARY KEY, alias TEXT, filename TEXT)"
+                )
+                con.execute("CREATE INDEX IF NOT EXISTS aliases_file ON aliases (filename)")
+                con.execute(
+                    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+                )
+            self._connection = con
+            self._check_normalize()
+        return self._connection
+
+    def _check_normalize(self):
+        """create the keys of all names again, if normalize changed"""
+        version = str(self.normalize_version)
+        if self._get_meta("normalize_version") == version:
+            return
+        with self._lock:
+            with self._connection as con:
+                rows = con.execute("SELECT filename, ids FROM files").fetchall()
+                con.execute("DELETE FROM names")
+                con.executemany(
+                    "INSERT OR REPLACE INTO names VALUES (?, ?)",
+                    [(self.normalize(name), f) for f, ids in rows for name in json.loads(ids)],
+                )
+                rows = con.execute("SELECT alias, filename FROM aliases").fetchall()
+                con.execute("DELETE FROM aliases")
+                con.executemany(
+                    "INSERT OR REPLACE INTO aliases VALUES (?, ?, ?)",
+                    [(self.normalize(alias), alias, f) for alias, f in rows],
+                )
+                self._set_meta(con, "normalize_version", version)
+
+    def _get_meta(self, key):
+        row = self.connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row is not None else None
+
+    def _set_meta(self, con, key, value):
+        con.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, str(value)))
+
+    def _path(self, filename):
+        return os.path.join(self.folder, filename)
+
+    def _write_file(self, con, filename, stat, ids):
+        """ replace the entry of one file and its names """
+        con.execute("DELETE FROM names WHERE filename = ?", (filename,))
+        con.execute(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+            (filename, stat.st_mtime_ns, stat.st_size, json.dumps(ids)),
+        )
+        con.executemany(
+            "INSERT OR REPLACE INTO names VALUES (?, ?)",
+            [(self.normalize(name), filename) for name in ids],
+        )
+
+    def _remove_file(self, con, filename):
+        con.execute("DELETE FROM names WHERE filename = ?", (filename,))
+        con.execute("DELETE FROM aliases WHERE filename = ?", (filename,))
+        con.execute("DELETE FROM files WHERE filename = ?", (filename,))
+
+    def files(self):
+        """ modification time (in ns) and size of all indexed files, by filename """
+        rows = self.connection.execute("SELECT filename, mtime, size FROM files")
+        return {filename: (mtime, size) for filename, mtime, size in rows}
+
+    def update(self, read_ids, force=False):
+        """
+        Bring the index up to date with the folder
+
+        Parameters
+        ----------
+        read_ids : callable
+            read_ids(list of paths) returns the list of ids for each of the files
+        force : bool, optional
+            read the ids of every file again, even if it did not change, by default False
+
+        Returns
+        -------
+        changed : list
+            filenames that were (re)indexed or removed
+        """
+        with self._lock:
+            # Taken before the scan, so that files added during the scan
+            # are found by the next update_if_changed
+            folder_mtime = os.stat(self.folder).st_mtime_ns
+            # The folder mtime does not change when files are modified in
+            # place, so the stats of all files are compared every time
+            known = self.files()
+            current = {}
+            for entry in os.scandir(self.folder):
+                if entry.name.endswith(".flex") and entry.is_file():
+                    stat = entry.stat()
+                    current[entry.name] = (stat.st_mtime_ns, stat.st_size)
+
+            changed = [f for f, info in current.items() if force or known.get(f) != info]
+            removed = [f for f in known if f not in current]
+            ids = read_ids([self._path(f) for f in changed]) if len(changed) > 0 else []
+
+            with self.connection as con:
+                for filename in removed:
+                    self._remove_file(con, filename)
+                for filename, file_ids in zip(changed, ids):
+                    self._write_file(con, filename, os.stat(self._path(filename)), file_ids)
+                self._set_meta(con, "folder_mtime", folder_mtime)
+            return changed + removed
+
+    def update_if_changed(self, read_ids):
+        """
+        Like update, but only if files were added, removed or renamed since
+        the last update
+
+        This only needs the modification time of the folder, instead of the
+        stats of all files. Files that are modified in place are not found,
+        use check_file or update for them.
+
+        Returns
+        -------
+        changed : list
+            filenames that were (re)indexed or removed
+        """
+        if self._get_meta("folder_mtime") == str(os.stat(self.folder).st_mtime_ns):
+            return []
+        with self._lock:
+            # Another thread might have updated the index in the meantime
+            if self._get_meta("folder_mtime") == str(os.stat(self.folder).st_mtime_ns):
+                return []
+            return self.update(read_ids)
+
+    def update_file(self, filename, ids):
+        """ record the ids of a file that was just written """
+        filename = os.path.basename(filename)
+        with self._lock:
+            with self.connection as con:
+                self._write_file(con, filename, os.stat(self._path(filename)), list(ids))
+
+    def check_file(self, filename, read_ids):
+        """
+        Reindex a single file, if it was modified since it was indexed
+
+        Returns True if the file was reindexed.
+        """
+        filename = os.path.basename(filename)
+        stat = os.stat(self._path(filename))
+        row = self.connection.execute(
+            "SELECT mtime, size FROM files WHERE filename = ?", (filename,)
+        ).fetchone()
+        if row is not None and tuple(row) == (stat.st_mtime_ns, stat.st_size):
+            return False
+        self.update_file(filename, read_ids([self._path(filename)])[0])
+        return True
+
+    def add_aliases(self, filename, aliases):
+        """
+        add names of the star in a file, that are not in its ids
+
+        The aliases are kept when the file changes, and removed with it.
+        """
+        filename = os.path.basename(filename)
+        with self._lock:
+            with self.connection as con:
+                con.executemany(
+                    "INSERT OR REPLACE INTO aliases VALUES (?, ?, ?)",
+                    [(self.normalize(alias), alias, filename) for alias in aliases],
+                )
+
+    def _lookup(self, name):
+        """filename of the star with the given name, or None"""
+        key = self.normalize(name)
+        row = self.connection.execute(
+            "SELECT filename FROM names WHERE name = ? "
+            "UNION ALL SELECT filename FROM aliases WHERE name = ? LIMIT 1",
+            (key, key),
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    def ids(self, filename):
+        """ all ids stored for the given file """
+        row = self.connection.execute(
+            "SELECT ids FROM files WHERE filename = ?", (os.path.basename(filename),)
+        ).fetchone()
+        if row is None:
+            raise KeyError(filename)
+        return json.loads(row[0])
+
+    def __getitem__(self, name):
+        filename = self._lookup(name)
+        if filename is None:
+            raise KeyError(name)
+        return self._path(filename)
+
+    def __setitem__(self, name, filename):
+        with self._lock:
+            with self.connection as con:
+                con.execute(
+                    "INSERT OR REPLACE INTO names VALUES (?, ?)",
+                    (self.normalize(name), os.path.basename(filename)),
+                )
+
+    def __delitem__(self, name):
+        with self._lock:
+            with self.connection as con:
+                key = self.normalize(name)
+                count = con.execute("DELETE FROM names WHERE name = ?", (key,)).rowcount
+                count += con.execute("DELETE FROM aliases WHERE name = ?", (key,)).rowcount
+            if count == 0:
+                raise KeyError(name)
+
+    def __contains__(self, name):
+        return self._lookup(name) is not None
+
+    def __iter__(self):
+        rows = self.connection.execute(
+            "SELECT name FROM names UNION SELECT name FROM aliases"
+        ).fetchall()
+        return (name for (name,) in rows)
+
+    def __len__(self):
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM (SELECT name FROM names UNION SELECT name FROM aliases)"
+        ).fetchone()[0]
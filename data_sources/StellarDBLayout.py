@@ -0,0 +1,309 @@
+"""
+Compiled layouts, that convert the data of a data source into stellar db fields
+
+A layout (layout_*.yaml) describes for each field of the stellar db, which
+column of the data source to use and what unit to apply. Compiling it once
+resolves the units and classes, so that applying it only needs to look up
+the data.
+"""
+import importlib
+
+import numpy as np
+import astropy.units as u
+import astropy.coordinates as coords
+from astropy.time import Time
+
+
+def make_converter(unit):
+    """
+    function that applies the unit of a layout field to a value
+
+    Returns the converter for single values, and the one for arrays of values.
+    """
+    if unit is None or unit == "str":
+        return (lambda value: value), (lambda values: values)
+    elif unit == "hourangle":
+        func = lambda value: coords.Angle(value, u.hourangle)
+        return func, func
+    elif unit == "deg":
+        func = lambda value: (
+            coords.Angle(value, u.deg) if isinstance(value, str) else value << u.deg
+        )
+        many = lambda values: (
+            coords.Angle(values, u.deg) if values.dtype.kind in "OUS" else values << u.deg
+        )
+        return func, many
+    elif unit == "jd":
+        func = lambda value: Time(value, format=unit)
+        return func, func
+
+    try:
+        unit = u.Unit(unit)
+    except ValueError:
+        # Fail only when the field is actually used, as before
+        func = lambda value: value << u.Unit(unit)
+        return func, func
+    func = lambda value: value << unit
+    return func, func
+
+
+def extract(value):
+    """the plain value of a data entry"""
+    # Extract data from structures if necessary
+    if hasattr(value, "array"):
+        # Pandas array
+        value = value.array[0]
+    elif hasattr(value, "unmasked"):
+        # Astropy Masked Quantity
+        value = value.unmasked
+
+    if isinstance(value, bytes):
+        value = value.decode()
+    return value
+
+
+def is_bad(value):
+    """missing values, i.e. None, nan and masked"""
+    # value != value == nan
+    return value is None or value != value or np.ma.is_masked(value)
+
+
+def set_meta(value, ref, unc):
+    """store the reference and uncertainty with a value, if it supports that"""
+    try:
+        if value.info.meta is None:
+            value.info.meta = {}
+        if ref is not None:
+            value.info.meta["reference"] = ref
+        if unc is not None:
+            value.info.meta["uncertainty"] = unc
+    except:
+        pass
+
+
+class Column:
+    """one column of a table, with the missing values marked"""
+
+    def __init__(self, table, name, rows=None):
+        column = table[name]
+        if hasattr(column, "iloc"):
+            # Pandas Series, rows are positions and not labels of the index
+            column = column.to_numpy()
+        if rows is not None:
+            column = column[rows]
+        mask = None
+        if hasattr(column, "unmasked"):
+            # Astropy Masked Quantity, single values ignore the mask as well
+            column = column.unmasked
+        elif isinstance(column, np.ma.MaskedArray):
+            mask = np.ma.getmaskarray(column)
+            column = np.ma.getdata(column)
+        if not isinstance(column, u.Quantity):
+            column = np.asarray(column)
+            if column.dtype.kind in "OS":
+                column = np.array(
+                    [v.decode() if isinstance(v, bytes) else v for v in column],
+                    dtype=object if column.dtype.kind == "O" else str,
+                )
+        self.values = column
+        self.mask = mask if mask is not None else np.zeros(len(column), bool)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, i):
+        return None if self.mask[i] else self.values[i]
+
+    def bad(self):
+        """missing values, i.e. None, nan and masked"""
+        values = self.values
+        if isinstance(values, u.Quantity):
+            values = values.value
+        if values.dtype.kind == "f":
+            return self.mask | np.isnan(values)
+        if values.dtype.kind == "O":
+            return self.mask | np.array([v is None or v != v for v in values], bool)
+        return self.mask.copy()
+
+
+class Field:
+    """a single value, taken from one column of the data"""
+
+    def __init__(self, key, layout):
+        self.key = key
+        self.name = layout["name"]
+        self.unit = layout.get("unit", None)
+        self.ref = layout.get("ref", None)
+        unc = layout.get("unc", None)
+        self.unc = tuple(unc[:2]) if unc is not None else None
+        self.convert, self.convert_many = make_converter(self.unit)
+
+    def apply(self, data, result, skip_nan=True):
+        try:
+            ref = data[self.ref] if self.ref is not None else None
+        except KeyError:
+            ref = None
+        try:
+            unc = (data[self.unc[0]], data[self.unc[1]]) if self.unc is not None else None
+        except KeyError:
+            unc = None
+        try:
+            value = data[self.name]
+        except KeyError:
+            # Skip missing data
+            return
+
+        value = extract(value)
+        if skip_nan and is_bad(value):
+            # Skip bad values
+            return
+
+        # Apply the correct units
+        value = self.convert(value)
+        # Apply Meta information
+        set_meta(value, ref, unc)
+        # Store data
+        result[self.key] = value
+
+    def _column(self, columns, table, name, rows):
+        if name not in columns:
+            try:
+                columns[name] = Column(table, name, rows)
+            except KeyError:
+                columns[name] = None
+        return columns[name]
+
+    def apply_table(self, table, results, columns, rows=None, skip_nan=True):
+        values = self._column(columns, table, self.name, rows)
+        if values is None:
+            # Skip missing data
+            return
+        ref = self._column(columns, table, self.ref, rows) if self.ref is not None else None
+        unc = None
+        if self.unc is not None:
+            unc = [self._column(columns, table, name, rows) for name in self.unc]
+            if unc[0] is None or unc[1] is None:
+                unc = None
+
+        good = ~values.bad() if skip_nan else np.ones(len(values), bool)
+        index = np.flatnonzero(good)
+        # Apply the units to all values at once, if possible
+        try:
+            converted = self.convert_many(values.values[index])
+        except Exception:
+            converted = [self.convert(values[i]) for i in index]
+
+        for j, i in enumerate(index):
+            value = converted[j]
+            row_ref = ref[i] if ref is not None else None
+            row_unc = (unc[0][i], unc[1][i]) if unc is not None else None
+            set_meta(value, row_ref, row_unc)
+            results[i][self.key] = value
+
+
+class Group:
+    """a dictionary of fields"""
+
+    def __init__(self, key, layout):
+        self.key = key
+        self.plan = Plan(layout)
+
+    def apply(self, data, result, skip_nan=True):
+        result[self.key] = self.plan.apply(data)
+
+    def apply_table(self, table, results, columns, rows=None, skip_nan=True):
+        values = self.plan._apply_table(table, len(results), columns, rows)
+        for result, value in zip(results, values):
+            result[self.key] = value
+
+
+class Constructor(Group):
+    """an object, created from a dictionary of fields"""
+
+    def __init__(self, key, layout):
+        module = importlib.import_module(layout["__module__"])
+        self.cls = getattr(module, layout["__class__"])
+        layout = {k: v for k, v in layout.items() if k != "class"}
+        super().__init__(key, layout)
+
+    def apply(self, data, result, skip_nan=True):
+        result[self.key] = self.cls(**self.plan.apply(data))
+
+    def apply_table(self, table, results, columns, rows=None, skip_nan=True):
+        values = self.plan._apply_table(table, len(results), columns, rows)
+        for result, value in zip(results, values):
+            result[self.key] = self.cls(**value)
+
+
+class Plan:
+    """
+    A compiled layout
+
+    apply fills the layout from a single record, e.g. a dict or a table row,
+    apply_table fills it for all rows of a table at once.
+    """
+
+    def __init__(self, layout):
+        self.entries = []
+        for key, value in layout.items():
+            if key.startswith("__"):
+                continue
+            if "name" in value:
+                self.entries.append(Field(key, value))
+            elif "__class__" in value:
+                self.entries.append(Constructor(key, value))
+            else:
+                self.entries.append(Group(key, value))
+
+    def apply(self, data, skip_nan=True):
+        """
+        Fill the fields of the layout, with data from data
+
+        Parameters
+        ----------
+        data : dict
+            input data, e.g. a dict, a table row or a DataFrame
+        skip_nan : bool, optional
+            skip missing values, by default True
+
+        Returns
+        -------
+        result : dict
+            the stellar db fields
+        """
+        result = {}
+        for entry in self.entries:
+            entry.apply(data, result, skip_nan=skip_nan)
+        return result
+
+    def apply_table(self, table, rows=None, skip_nan=True):
+        """
+        Fill the fields of the layout for many rows of a table at once
+
+        Equivalent to [apply(row) for row in table], but the columns are
+        only looked up once, and the units are applied to whole columns.
+
+        Parameters
+        ----------
+        table : QTable, DataFrame
+            input data, indexed by column name
+        rows : array, optional
+            only use these rows of the table, by default all rows
+        skip_nan : bool, optional
+            skip missing values, by default True
+
+        Returns
+        -------
+        results : list
+            the stellar db fields for each row
+        """
+        if rows is None:
+            rows = np.arange(len(table))
+        rows = np.asarray(rows)
+        return self._apply_table(table, len(rows), {}, rows, skip_nan=skip_nan)
+
+    def _apply_table(self, table, n, columns, rows, skip_nan=True):
+        results = [{} for _ in range(n)]
+        for entry in self.entries:
+            entry.apply_table(table, results, columns, rows, skip_nan=skip_nan)
+        return results
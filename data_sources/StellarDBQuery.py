@@ -0,0 +1,317 @@
+"""
+Columnar tables of all stars (and planets) in the stellar db, for queries
+
+The values of every star are read from the json headers of the flex files,
+converted to one unit per field, and stored as DataFrames in the cache.
+Only files that were added, changed or removed since the last update are
+read again.
+"""
+import logging
+import os
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+import astropy.units as u
+
+try:
+    from . import Cache, StellarDBIndex
+except:
+    import Cache
+    import StellarDBIndex
+
+
+def is_encoded(value):
+    """whether value is the json representation of an object"""
+    return isinstance(value, dict) and "__class__" in value and "__module__" in value
+
+
+def flatten(node, prefix=""):
+    """
+    the plain values of a (json) header, by field name
+
+    Nested fields are joined with ".", e.g. coordinates.ra or flux.V.
+    Quantities are stored as (value, unit), other objects are split into
+    their fields, and lists (except for the ids) and planets are skipped.
+
+    Returns
+    -------
+    values : dict
+        value, or (value, unit) for each field
+    """
+    values = {}
+    for key, value in node.items():
+        if key.startswith("__") or key in ["planets", "citation"]:
+            continue
+        name = prefix + key
+        if is_encoded(value):
+            if "unit" in value and not isinstance(value.get("value"), (list, dict)):
+                number = value["value"]
+                values[name] = (number if number is not None else np.nan, value["unit"])
+            elif value["__class__"] == "Time":
+                values[name] = value["value"]
+            else:
+                values.update(flatten(value, name + "."))
+        elif isinstance(value, dict):
+            values.update(flatten(value, name + "."))
+        elif isinstance(value, list):
+            if key == "id" and prefix == "":
+                values["id"] = value[0] if len(value) > 0 else None
+                values["ids"] = "|".join(value)
+        else:
+            values[name] = value
+    return values
+
+
+def read_rows(fname):
+    """the values of the star, and of each of its planets, in a flex file"""
+    header = StellarDBIndex.read_header(fname)
+    if isinstance(header.get("id"), str):
+        header["id"] = [header["id"]]
+    star = flatten(header)
+    planets = []
+    for letter, planet in (header.get("planets") or {}).items():
+        if isinstance(planet, dict):
+            row = flatten(planet)
+            row["letter"] = letter
+            planets.append(row)
+    return star, planets
+
+
+@lru_cache(maxsize=None)
+def _factor(unit, target):
+    """conversion factor between two units, None if they are not compatible"""
+    try:
+        return u.Unit(unit).to(u.Unit(target))
+    except (ValueError, u.UnitsError):
+        return None
+
+
+class StarTable:
+    """
+    Columnar tables of all stars and planets in a stellar db folder
+
+    stars has one row per flex file (the filename is the index), planets one
+    row per planet, with the filename of its star and its letter. Quantities
+    are stored as floats in the unit given by units.
+
+    Examples
+    --------
+    Cool stars with transiting planets
+
+    >>> table.hosts("t_eff < 4000", "transit_depth > 0")
+
+    Field names with a dot need backticks in query strings
+
+    >>> table.select("`flux.V` < 8", columns=["id", "flux.V"])
+    """
+
+    #:int: version of the table format, increase to rebuild existing caches
+    version = 1
+
+    def __init__(self, folder, cache_folder, processes=None, chunksize=None):
+        self.folder = os.path.abspath(os.path.expanduser(folder))
+        self.cache_folder = cache_folder
+        self.processes = processes
+        self.chunksize = chunksize
+        self.stars = pd.DataFrame(index=pd.Index([], name="filename"))
+        self.planets = pd.DataFrame({"filename": pd.Series([], dtype=str)})
+        self.units = {}
+        self.files = {}
+        #:int: increases with every change of the tables
+        self.revision = 0
+        self._loaded = False
+
+    def _cache(self, name):
+        return Cache.Cache(
+            self.cache_folder, "StellarDBQuery", self.folder, self.version, name,
+            namespace="STELLARDB",
+        )
+
+    def _load(self):
+        """the tables from the last update, if they are in the cache"""
+        self._loaded = True
+        try:
+            meta = self._cache("meta").load()
+            stars = self._cache("stars").load()
+            planets = self._cache("planets").load()
+        except FileNotFoundError:
+            return
+        self.files, self.units = meta["files"], meta["units"]
+        self.stars, self.planets = stars, planets
+        self.revision += 1
+
+    def _save(self):
+        self._cache("stars").save(self.stars)
+        self._cache("planets").save(self.planets)
+        self._cache("meta").save({"files": self.files, "units": self.units})
+
+    def _to_unit(self, name, value, unit):
+        """convert value to the unit of the column"""
+        target = self.units.setdefault(name, unit)
+        if unit == target:
+            return value
+        factor = _factor(unit, target)
+        if factor is None:
+            logging.warning("Unit %s of %s is not compatible with %s" % (unit, name, target))
+            return np.nan
+        return value * factor
+
+    def _record(self, values, prefix=""):
+        """one row of a table, the units are stored under prefix + field name"""
+        return {
+            name: self._to_unit(prefix + name, *value) if isinstance(value, tuple) else value
+            for name, value in values.items()
+        }
+
+    def update(self, files=None):
+        """
+        Bring the tables up to date with the folder
+
+        Parameters
+        ----------
+        files : dict, optional
+            (modification time, size) of all flex files by filename, e.g.
+            from NameIndex.files(). By default the folder is scanned.
+
+        Returns
+        -------
+        changed : list
+            filenames that were read again or removed
+        """
+        if not self._loaded:
+            self._load()
+        if files is None:
+            files = {}
+            for entry in os.scandir(self.folder):
+                if entry.name.endswith(".flex") and entry.is_file():
+                    stat = entry.stat()
+                    files[entry.name] = (stat.st_mtime_ns, stat.st_size)
+        files = {k: tuple(v) for k, v in files.items()}
+
+        changed = [f for f, info in files.items() if self.files.get(f) != info]
+        removed = [f for f in self.files if f not in files]
+        if len(changed) == 0 and len(removed) == 0:
+            return []
+        self._replace(changed, removed)
+        self.files = files
+        self._save()
+        return changed + removed
+
+    def update_files(self, filenames):
+        """
+        Read the given files again, e.g. right after they were saved
+
+        Parameters
+        ----------
+        filenames : list
+            names of the files in the folder (or their full paths)
+        """
+        if not self._loaded:
+            self._load()
+        filenames = [os.path.basename(f) for f in filenames]
+        removed = []
+        for filename in filenames:
+            try:
+                stat = os.stat(os.path.join(self.folder, filename))
+                self.files[filename] = (stat.st_mtime_ns, stat.st_size)
+            except FileNotFoundError:
+                self.files.pop(filename, None)
+                removed.append(filename)
+        changed = [f for f in filenames if f not in removed]
+        self._replace(changed, removed)
+        self._save()
+
+    def _replace(self, changed, removed):
+        """read the changed files, and replace their rows"""
+        rows = StellarDBIndex.parallel_map(
+            read_rows,
+            [os.path.join(self.folder, f) for f in changed],
+            self.processes,
+            self.chunksize,
+        )
+        stars, planets = [], []
+        for filename, (star, star_planets) in zip(changed, rows):
+            stars.append(self._record(star))
+            for planet in star_planets:
+                planet = self._record(planet, prefix="planets.")
+                planet["filename"] = filename
+                planets.append(planet)
+
+        drop = set(changed) | set(removed)
+        new_stars = pd.DataFrame.from_records(stars, index=pd.Index(changed, name="filename"))
+        new_planets = pd.DataFrame.from_records(planets)
+        self.stars = pd.concat([self.stars[~self.stars.index.isin(drop)], new_stars])
+        self.planets = pd.concat(
+            [self.planets[~self.planets["filename"].isin(drop)], new_planets],
+            ignore_index=True,
+        )
+        self.revision += 1
+
+    def unit(self, name, planets=False):
+        """the unit of a column, None if it has no unit"""
+        return self.units.get("planets." + name if planets else name)
+
+    def column(self, name, planets=False):
+        """the values of a column, as Quantity if it has a unit"""
+        table = self.planets if planets else self.stars
+        values = table[name].to_numpy()
+        unit = self.unit(name, planets)
+        if unit is not None:
+            return values.astype(float) << u.Unit(unit)
+        return values
+
+    def _where(self, table, where):
+        if where is None:
+            return table
+        elif isinstance(where, str):
+            return table.query(where)
+        else:
+            return table[np.asarray(where)]
+
+    def select(self, where=None, columns=None, planets=False):
+        """
+        Select rows and columns of the stars (or planets)
+
+        Parameters
+        ----------
+        where : str, array, optional
+            pandas query string, e.g. "t_eff < 4000", or boolean mask
+        columns : list, optional
+            only return these columns, by default all
+        planets : bool, optional
+            select from the planets instead of the stars, by default False
+
+        Returns
+        -------
+        selection : DataFrame
+        """
+        table = self.planets if planets else self.stars
+        table = self._where(table, where)
+        if columns is not None:
+            table = table[[c for c in columns if c in table]]
+        return table
+
+    def hosts(self, where=None, planets_where=None, columns=None):
+        """
+        Select stars, that have at least one planet that matches planets_where
+
+        Parameters
+        ----------
+        where : str, array, optional
+            condition on the stars, see select
+        planets_where : str, array, optional
+            condition on the planets, see select
+        columns : list, optional
+            only return these columns of the stars, by default all
+
+        Returns
+        -------
+        selection : DataFrame
+        """
+        filenames = self._where(self.planets, planets_where)["filename"]
+        stars = self.stars[self.stars.index.isin(filenames)]
+        stars = self._where(stars, where)
+        if columns is not None:
+            stars = stars[[c for c in columns if c in stars]]
+        return stars
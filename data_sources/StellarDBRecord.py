@@ -0,0 +1,189 @@
+"""
+Lazy records of the stellar db
+
+The header of a flex file stores astropy objects as small json objects
+(module, class, value and unit). Converting all of them when a star is
+loaded is slow and uses a lot of memory, while most of the time only a few
+values of a star are used. LazyRecord keeps the json representation, and
+only creates the astropy object of a value when it is accessed.
+"""
+import copy
+import sys
+from collections.abc import MutableMapping
+from functools import lru_cache
+
+import astropy.units as u
+from flex.json_encoder import FlexJSONDecoder
+
+_decoder = FlexJSONDecoder()
+
+
+def is_encoded(value):
+    """whether value is the json representation of an object"""
+    return (
+        isinstance(value, dict)
+        and "__class__" in value
+        and "__module__" in value
+        and not value.get("__header__", False)
+    )
+
+
+class RawQuantity:
+    """compact representation of a Quantity, that has not been used yet"""
+
+    __slots__ = ["value", "unit"]
+
+    def __init__(self, value, unit):
+        self.value = value
+        self.unit = unit
+
+    def __repr__(self):
+        return "RawQuantity(%r, %r)" % (self.value, self.unit)
+
+    def to_json(self):
+        return {
+            "__module__": "astropy.units.quantity",
+            "__class__": "Quantity",
+            "value": self.value,
+            "unit": self.unit,
+        }
+
+
+def compact(raw):
+    """replace the json objects of quantities with RawQuantity, which uses much less memory"""
+    if isinstance(raw, dict):
+        if (
+            raw.get("__class__") == "Quantity"
+            and raw.get("__module__") == "astropy.units.quantity"
+            and raw.keys() == {"__module__", "__class__", "value", "unit"}
+            and not isinstance(raw["value"], (list, dict))
+        ):
+            return RawQuantity(raw["value"], sys.intern(raw["unit"]))
+        if is_encoded(raw):
+            # Other objects are decoded as a whole
+            return raw
+        return {k: compact(v) for k, v in raw.items()}
+    elif isinstance(raw, list):
+        return [compact(v) for v in raw]
+    return raw
+
+
+def materialize(raw):
+    """create the python object of a json value"""
+    if isinstance(raw, RawQuantity):
+        value = raw.value if raw.value is not None else float("nan")
+        return u.Quantity(value, _unit(raw.unit))
+    elif is_encoded(raw):
+        # The decoder modifies its input
+        return _decoder._object_hook(copy.deepcopy(raw))
+    elif isinstance(raw, dict):
+        return LazyRecord(raw)
+    elif isinstance(raw, list):
+        return [materialize(v) for v in raw]
+    return raw
+
+
+def to_raw(value):
+    """the json compatible representation of a (partially) materialized value"""
+    if isinstance(value, LazyRecord):
+        return value.to_dict()
+    elif isinstance(value, RawQuantity):
+        return value.to_json()
+    elif isinstance(value, dict):
+        return {k: to_raw(v) for k, v in value.items()}
+    elif isinstance(value, list):
+        return [to_raw(v) for v in value]
+    return value
+
+
+@lru_cache(maxsize=None)
+def _unit(name):
+    return u.Unit(name)
+
+
+class LazyRecord(MutableMapping):
+    """
+    Star data, that creates the astropy objects of its values on first access
+
+    Behaves like the dictionary returned by FlexFile.read. Nested dictionaries,
+    like the planets, are LazyRecords as well. Use value() to get plain
+    numbers without creating astropy objects at all.
+    """
+
+    def __init__(self, raw=None):
+        """
+        Parameters
+        ----------
+        raw : dict, optional
+            the json representation of the data, e.g. a flex header
+        """
+        self._data = compact(raw) if raw is not None else {}
+        self._decoded = set()
+
+    def __getitem__(self, key):
+        if key not in self._decoded:
+            self._data[key] = materialize(self._data[key])
+            self._decoded.add(key)
+        return self._data[key]
+
+    def __setitem__(self, key, value):
+        self._data[key] = value
+        self._decoded.add(key)
+
+    def __delitem__(self, key):
+        del self._data[key]
+        self._decoded.discard(key)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return "%s(%r)" % (type(self).__name__, self.to_dict())
+
+    def raw(self, key):
+        """a value without creating any objects, i.e. its json representation if it was not used yet"""
+        return to_raw(self._data[key])
+
+    def value(self, key, unit=None):
+        """
+        the plain value of a field, e.g. a float instead of a Quantity
+
+        Parameters
+        ----------
+        key : str
+            name of the field
+        unit : str, Unit, optional
+            convert quantities to this unit, by default their own unit
+
+        Returns
+        -------
+        value : float, str, ...
+            the value, nan if it is missing
+        """
+        raw = self._data[key]
+        if key not in self._decoded and isinstance(raw, RawQuantity):
+            value = raw.value
+            if value is None:
+                return float("nan")
+            if unit is not None:
+                value = _unit(raw.unit).to(unit, value)
+            return value
+
+        value = self[key]
+        if isinstance(value, u.Quantity):
+            return value.to_value(unit) if unit is not None else value.value
+        return value
+
+    def to_dict(self):
+        """
+        a plain dictionary, e.g. for writing a flex file
+
+        Values that have not been accessed stay in their json representation.
+        """
+        return {key: self.raw(key) for key in self._data}
@@ -0,0 +1,144 @@
+"""
+Spatial index of the stars in the stellar db, for cone searches
+
+The positions come from the coordinates of the columnar query tables (see
+StellarDBQuery), which are cached and updated incrementally. The index
+itself is a KD-tree on the unit vectors of the positions, which takes only
+milliseconds to build even for large databases.
+"""
+import numpy as np
+import astropy.units as u
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    # Without scipy, we compare with all positions
+    cKDTree = None
+
+
+def to_deg(angle):
+    """angle in degrees, from a Quantity or a float in degrees"""
+    if hasattr(angle, "unit"):
+        return angle.to_value(u.deg)
+    return np.asarray(angle, dtype=float)
+
+
+def unit_vectors(ra, dec):
+    """cartesian unit vectors of positions in degrees"""
+    ra, dec = np.deg2rad(ra), np.deg2rad(dec)
+    cos_dec = np.cos(dec)
+    return np.stack([cos_dec * np.cos(ra), cos_dec * np.sin(ra), np.sin(dec)], axis=-1)
+
+
+def chord_to_angle(chord):
+    """angular separation in degrees, from the distance between unit vectors"""
+    return np.rad2deg(2 * np.arcsin(np.clip(chord / 2, 0, 1)))
+
+
+def angle_to_chord(angle):
+    """distance between unit vectors, from the angular separation in degrees"""
+    return 2 * np.sin(np.deg2rad(np.clip(angle, 0, 180)) / 2)
+
+
+class SpatialIndex:
+    """
+    Cone search and nearest neighbours of the stars in a StarTable
+
+    The index is rebuilt automatically, when the table changes.
+    """
+
+    def __init__(self, table):
+        """
+        Parameters
+        ----------
+        table : StarTable
+            tables of the stellar db, with the columns coordinates.ra and coordinates.dec
+        """
+        self.table = table
+        self._revision = None
+        self.filenames = np.array([], dtype=object)
+        self.xyz = np.zeros((0, 3))
+        self.tree = None
+
+    def _build(self):
+        """index the current positions of the table"""
+        if self._revision == self.table.revision:
+            return
+        stars = self.table.stars
+        if "coordinates.ra" in stars and "coordinates.dec" in stars:
+            ra = to_deg(self.table.column("coordinates.ra"))
+            dec = to_deg(self.table.column("coordinates.dec"))
+            good = np.isfinite(ra) & np.isfinite(dec)
+            self.filenames = stars.index.to_numpy()[good]
+            self.xyz = unit_vectors(ra[good], dec[good])
+        else:
+            self.filenames = np.array([], dtype=object)
+            self.xyz = np.zeros((0, 3))
+        self.tree = cKDTree(self.xyz) if cKDTree is not None and len(self.xyz) > 0 else None
+        self._revision = self.table.revision
+
+    def _result(self, index, chord):
+        """the rows of the stars, with their separation in degrees, closest first"""
+        order = np.argsort(chord, kind="stable")
+        index, chord = np.asarray(index)[order], np.asarray(chord)[order]
+        result = self.table.stars.loc[self.filenames[index]].copy()
+        result["separation"] = chord_to_angle(chord)
+        return result
+
+    def cone_search(self, ra, dec, radius):
+        """
+        All stars within radius of a position
+
+        Parameters
+        ----------
+        ra, dec : Quantity, float
+            position, floats are in degrees
+        radius : Quantity, float
+            search radius, floats are in degrees
+
+        Returns
+        -------
+        stars : DataFrame
+            the rows of the stars, and their separation in degrees, closest first
+        """
+        self._build()
+        center = unit_vectors(to_deg(ra), to_deg(dec))
+        chord = angle_to_chord(to_deg(radius))
+        if self.tree is not None:
+            index = np.array(self.tree.query_ball_point(center, chord), dtype=int)
+            distance = np.linalg.norm(self.xyz[index] - center, axis=-1)
+        else:
+            distance = np.linalg.norm(self.xyz - center, axis=-1)
+            index = np.flatnonzero(distance <= chord)
+            distance = distance[index]
+        return self._result(index, distance)
+
+    def nearest(self, ra, dec, k=1):
+        """
+        The k stars closest to a position
+
+        Parameters
+        ----------
+        ra, dec : Quantity, float
+            position, floats are in degrees
+        k : int, optional
+            number of stars, by default 1
+
+        Returns
+        -------
+        stars : DataFrame
+            the rows of the stars, and their separation in degrees, closest first
+        """
+        self._build()
+        k = min(k, len(self.xyz))
+        center = unit_vectors(to_deg(ra), to_deg(dec))
+        if k == 0:
+            return self._result([], [])
+        if self.tree is not None:
+            distance, index = self.tree.query(center, k=k)
+            distance, index = np.atleast_1d(distance), np.atleast_1d(index)
+        else:
+            distance = np.linalg.norm(self.xyz - center, axis=-1)
+            index = np.argpartition(distance, k - 1)[:k]
+            distance = distance[index]
+        return self._result(index, distance)
@@ -31,5 +31,21 @@ def load_config(filename=None):
     c = load_yaml(filename)
 
     for k, v in c.items():
-        c[k] = os.path.expanduser(v)
+        if isinstance(v, str):
+            c[k] = os.path.expanduser(v)
     return c
+
+
+_loaded_config = None
+
+
+def get_config():
+    """
+    Configuration from the default file, loaded only once per process
+
+    The dictionary is shared by all callers, and should not be modified.
+    """
+    global _loaded_config
+    if _loaded_config is None:
+        _loaded_config = load_config()
+    return _loaded_config
@@ -26,11 +26,12 @@ def idlToPandas(fileName, keyValue=None,folder = './DATA/IDL/', UseCache = True)
     within an IDL save file and add it to a pandas
     data frame."""
 
-    cache = Cache.Cache(folder,fileName,keyValue)
-    data = cache.load() if UseCache else None
-    
-    if data is not None: 
-        return data
+    cache = Cache.Cache(folder,fileName,keyValue,namespace='IDL')
+    if UseCache:
+        try:
+            return cache.load()
+        except FileNotFoundError:
+            pass
 
     logging.info('Loading IDL file: %s' % fileName)
     idlSavedVars = readsav(fileName)
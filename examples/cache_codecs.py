@@ -0,0 +1,89 @@
+"""
+Compare the compression codecs of the cache
+
+For payloads shaped like the ones we actually cache (PSG spectra strings,
+ESO archive CSV tables and the exoplanets tables), store them with every
+available codec and report the size on disk and the time to save and load.
+"""
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from data_sources import Cache
+
+
+def psg_payload(n_lines=20000):
+    """ PSG returns a text table with a commented header """
+    rng = np.random.default_rng(0)
+    wave = np.linspace(10000, 10100, n_lines)
+    header = "# Planetary Spectrum Generator\n# Wave/freq Total Noise Stellar Planet\n"
+    values = rng.normal(1, 0.01, (n_lines, 4))
+    lines = ["%.6f %.6e %.6e %.6e %.6e" % (w, *v) for w, v in zip(wave, values)]
+    return header + "\n".join(lines)
+
+
+def eso_payload(n_rows=20000):
+    """ ESO archive tables are read with dtype=str """
+    rng = np.random.default_rng(1)
+    mjd = 55000 + rng.uniform(0, 3000, n_rows)
+    return pd.DataFrame(
+        {
+            "Object": ["HD 209458"] * n_rows,
+            "ARCFILE": ["ADP.2014-%05i.%03i" % (i, i % 1000) for i in range(n_rows)],
+            "Instrument": ["HARPS"] * n_rows,
+            "MJD-OBS": ["%.6f" % m for m in mjd],
+            "Exptime": ["%.1f" % e for e in rng.choice([300, 600, 900], n_rows)],
+            "Release Date": ["2014-01-01"] * n_rows,
+        }
+    )
+
+
+def exoplanets_payload(n_rows=5000, n_columns=100):
+    """ exoplanets tables are mostly floats with many missing values """
+    rng = np.random.default_rng(2)
+    data = rng.lognormal(0, 1, (n_rows, n_columns))
+    data[rng.uniform(size=data.shape) < 0.4] = np.nan
+    df = pd.DataFrame(data, columns=["col%i" % i for i in range(n_columns)])
+    df["NAME"] = ["Star-%i b" % i for i in range(n_rows)]
+    return df
+
+
+def benchmark(folder, name, payload, codec, repeat=5):
+    cache = Cache.Cache(folder, name, codec, codec=codec)
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        cache.save(payload)
+    save_time = (time.perf_counter() - start) / repeat
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        # Measure the disk tier, not the memory tier
+        Cache.memory.clear()
+        cache.load()
+    load_time = (time.perf_counter() - start) / repeat
+
+    filename = cache._find()[1]
+    return os.path.getsize(filename), save_time, load_time
+
+
+if __name__ == "__main__":
+    payloads = {
+        "PSG": psg_payload(),
+        "ESO": eso_payload(),
+        "exoplanets": exoplanets_payload(),
+    }
+    codecs = [c for c in ["none", "zlib", "zstd", "lz4"] if c in Cache.codecs]
+
+    with tempfile.TemporaryDirectory() as folder:
+        print("%-12s %-6s %12s %10s %10s" % ("payload", "codec", "size [kB]", "save [ms]", "load [ms]"))
+        for name, payload in payloads.items():
+            for codec in codecs:
+                size, save_time, load_time = benchmark(folder, name, payload, codec)
+                print(
+                    "%-12s %-6s %12.1f %10.2f %10.2f"
+                    % (name, codec, size / 1024, save_time * 1000, load_time * 1000)
+                )
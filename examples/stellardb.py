@@ -1,6 +1,7 @@
 from data_sources.StellarDB import StellarDB
 
-sdb = StellarDB()
-sdb.auto_fill("TRAPPIST-1")
-
-pass
\ No newline at end of file
+# The guard is needed if the stellar db reads files with several processes
+# (stellardb_processes), which import this script again on spawn/forkserver
+if __name__ == "__main__":
+    sdb = StellarDB()
+    sdb.auto_fill("TRAPPIST-1")
@@ -7,5 +7,6 @@ setup(
     author_email="ansgar.wehrhahn@physics.uu.se",
     packages=find_packages(),
     install_requires=["numpy", "astropy", "astroquery", "pandas", "requests", "pyyaml", "flex-format"], #nist-asd, but it currently requires pprint, which is a standard lib, so it breaks pip
+    extras_require={"arrow": ["pyarrow"], "spatial": ["scipy"]},
     include_package_data=True
 )
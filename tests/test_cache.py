@@ -0,0 +1,188 @@
+import os
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from data_sources import Cache
+
+
+def run_with_timeout(func, timeout=10):
+    """run func in a thread, and fail instead of hanging if it does not finish"""
+    result = {}
+
+    def target():
+        result["value"] = func()
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "deadlock"
+    return result["value"]
+
+
+def same_stripe(folder):
+    """two keys, whose entries use the same lock file"""
+    seen = {}
+    i = 0
+    while True:
+        key = "k%i" % i
+        stripe = os.path.basename(Cache.Cache(folder, key).filename)[:3]
+        if stripe in seen:
+            return seen[stripe], key
+        seen[stripe] = key
+        i += 1
+
+
+def test_nested_load_or_create_same_stripe(tmp_path):
+    folder = str(tmp_path)
+    outer_key, inner_key = same_stripe(folder)
+
+    def inner():
+        return Cache.Cache(folder, inner_key).load_or_create(lambda: "inner")
+
+    def outer():
+        return Cache.Cache(folder, outer_key).load_or_create(lambda: "outer " + inner())
+
+    assert run_with_timeout(outer) == "outer inner"
+    assert Cache.Cache(folder, inner_key).load() == "inner"
+
+
+def test_lock_excludes_other_threads(tmp_path):
+    lock_file = str(tmp_path / "test.lock")
+    inside = []
+    overlap = []
+
+    def work():
+        for _ in range(20):
+            with Cache.FileLock(lock_file):
+                inside.append(1)
+                if len(inside) > 1:
+                    overlap.append(1)
+                inside.pop()
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    assert overlap == []
+
+
+def test_oversized_entry_is_not_cached(tmp_path):
+    folder = str(tmp_path)
+    Cache.CacheManager.get(folder).max_bytes = 10000
+    small = Cache.Cache(folder, "small")
+    small.save("small")
+
+    big = Cache.Cache(folder, "big")
+    big.save(np.zeros(5000))
+    with pytest.raises(FileNotFoundError):
+        big.load()
+    assert not os.path.exists(big.filename)
+    assert small.load() == "small"
+
+
+def test_new_entry_is_never_evicted(tmp_path):
+    folder = str(tmp_path)
+    Cache.CacheManager.get(folder).max_bytes = 10000
+    for i in range(4):
+        Cache.Cache(folder, "old%i" % i).save(np.zeros(200))
+    latest = Cache.Cache(folder, "latest")
+    latest.save(np.zeros(1180))
+    assert (latest.load() == 0).all()
+    assert Cache.CacheManager.get(folder).total_size() <= 10000
+
+
+def manager(folder, **kwargs):
+    """the manager of a folder, which writes every access to the index"""
+    result = Cache.CacheManager.get(folder)
+    result.touch_interval = 0
+    for name, value in kwargs.items():
+        setattr(result, name, value)
+    return result
+
+
+def test_lru_eviction(tmp_path):
+    folder = str(tmp_path)
+    first = Cache.Cache(folder, "a")
+    first.save(np.zeros(100))
+    size = os.path.getsize(first.filename)
+    manager(folder, max_bytes=int(3.5 * size))
+
+    for key in ["b", "c"]:
+        time.sleep(0.01)
+        Cache.Cache(folder, key).save(np.zeros(100))
+    time.sleep(0.01)
+    first.load()
+    time.sleep(0.01)
+    Cache.Cache(folder, "d").save(np.zeros(100))
+
+    kept = [key for key in "abcd" if os.path.exists(Cache.Cache(folder, key).filename)]
+    assert kept == ["a", "c", "d"]
+
+
+def test_ttl_expiry(tmp_path):
+    folder = str(tmp_path)
+    manager(folder)
+    cache = Cache.Cache(folder, "short", ttl=0.05)
+    cache.save([1, 2, 3])
+    assert cache.load() == [1, 2, 3]
+    time.sleep(0.1)
+    with pytest.raises(FileNotFoundError):
+        cache.load()
+    assert not os.path.exists(cache.filename)
+
+
+def test_copied_load_can_be_modified(tmp_path):
+    folder = str(tmp_path)
+    Cache.Cache(folder, "data").save(np.arange(5))
+    data = Cache.Cache(folder, "data").load()
+    data[0] = 100
+    assert Cache.Cache(folder, "data").load()[0] == 0
+
+
+def test_shared_load_is_read_only(tmp_path):
+    folder = str(tmp_path)
+    Cache.Cache(folder, "data", shared=True).save(np.arange(5))
+    data = Cache.Cache(folder, "data", shared=True).load()
+    with pytest.raises(ValueError):
+        data[0] = 100
+    assert Cache.Cache(folder, "data", shared=True).load()[0] == 0
+
+
+def test_not_found_round_trip(tmp_path):
+    folder = str(tmp_path)
+    Cache.Cache(folder, "missing").save_not_found("no such star")
+    with pytest.raises(Cache.NotFoundError, match="no such star"):
+        Cache.Cache(folder, "missing").load()
+
+
+def test_load_or_create_remembers_not_found(tmp_path):
+    folder = str(tmp_path)
+    calls = []
+
+    def create():
+        calls.append(1)
+        raise Cache.NotFoundError("no such star")
+
+    for _ in range(2):
+        with pytest.raises(Cache.NotFoundError):
+            Cache.Cache(folder, "missing").load_or_create(create)
+    assert len(calls) == 1
+
+
+def query(name, radius=1.0, catalogue="simbad"):
+    return name, radius, catalogue
+
+
+def test_make_key_positional_and_keyword():
+    keys = {
+        Cache.make_key(query, ("Trappist-1",), {})[1],
+        Cache.make_key(query, ("Trappist-1", 1.0), {})[1],
+        Cache.make_key(query, (), {"name": "Trappist-1", "catalogue": "simbad"})[1],
+        Cache.make_key(query, ("Trappist-1",), {"radius": 1.0})[1],
+    }
+    assert len(keys) == 1
+    assert Cache.make_key(query, ("Trappist-1", 2.0), {})[1] not in keys
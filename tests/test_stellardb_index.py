@@ -0,0 +1,105 @@
+import os
+
+from data_sources.StellarDBIndex import NameIndex, parallel_map
+
+
+class Reader:
+    """reads the ids of the test files, one per line, and counts the files"""
+
+    def __init__(self):
+        self.read = []
+
+    def __call__(self, filenames):
+        self.read += [os.path.basename(f) for f in filenames]
+        result = []
+        for filename in filenames:
+            with open(filename) as f:
+                result.append(f.read().split("\n"))
+        return result
+
+
+def write(folder, filename, *ids, mtime=None):
+    path = os.path.join(folder, filename)
+    with open(path, "w") as f:
+        f.write("\n".join(ids))
+    if mtime is not None:
+        os.utime(path, ns=(mtime, mtime))
+    return path
+
+
+def make_index(tmp_path):
+    folder = tmp_path / "db"
+    folder.mkdir()
+    return str(folder), NameIndex(str(folder), str(tmp_path / "cache"), normalize=str.lower)
+
+
+def test_update_reads_only_new_files(tmp_path):
+    folder, index = make_index(tmp_path)
+    write(folder, "a.flex", "Star A", "HD 1")
+    reader = Reader()
+    assert index.update(reader) == ["a.flex"]
+    assert index["hd 1"] == os.path.join(folder, "a.flex")
+
+    write(folder, "b.flex", "Star B")
+    reader.read.clear()
+    assert index.update(reader) == ["b.flex"]
+    assert reader.read == ["b.flex"]
+    assert "STAR B" in index and "Star A" in index
+
+
+def test_update_removes_files(tmp_path):
+    folder, index = make_index(tmp_path)
+    write(folder, "a.flex", "Star A")
+    write(folder, "b.flex", "Star B")
+    index.update(Reader())
+    os.remove(os.path.join(folder, "a.flex"))
+    assert index.update(Reader()) == ["a.flex"]
+    assert "Star A" not in index and "Star B" in index
+
+
+def test_update_finds_files_modified_in_place(tmp_path):
+    folder, index = make_index(tmp_path)
+    write(folder, "a.flex", "Star A", mtime=10**18)
+    index.update(Reader())
+    write(folder, "a.flex", "Star A", "GJ 1", mtime=2 * 10**18)
+    assert index.update(Reader()) == ["a.flex"]
+    assert "GJ 1" in index
+
+
+def test_check_file_finds_files_modified_in_place(tmp_path):
+    folder, index = make_index(tmp_path)
+    path = write(folder, "a.flex", "Star A", mtime=10**18)
+    index.update(Reader())
+    assert not index.check_file(path, Reader())
+    write(folder, "a.flex", "Star A", "GJ 1", mtime=2 * 10**18)
+    assert index.check_file(path, Reader())
+    assert "GJ 1" in index
+
+
+def test_update_if_changed_skips_unchanged_folder(tmp_path):
+    folder, index = make_index(tmp_path)
+    write(folder, "a.flex", "Star A")
+    index.update(Reader())
+    reader = Reader()
+    assert index.update_if_changed(reader) == []
+    assert reader.read == []
+
+    write(folder, "b.flex", "Star B")
+    os.utime(folder, ns=(3 * 10**18, 3 * 10**18))
+    assert index.update_if_changed(reader) == ["b.flex"]
+    assert "Star B" in index
+
+
+def test_aliases_are_removed_with_their_file(tmp_path):
+    folder, index = make_index(tmp_path)
+    path = write(folder, "a.flex", "Star A")
+    index.update(Reader())
+    index.add_aliases(path, ["TOI 1"])
+    assert index["toi 1"] == path
+    os.remove(path)
+    index.update(Reader())
+    assert "TOI 1" not in index
+
+
+def test_parallel_map_in_process_by_default():
+    assert parallel_map(len, ["a", "bb"] * 50) == [1, 2] * 50
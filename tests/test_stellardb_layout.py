@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import astropy.units as u
+from astropy.table import QTable
+
+from data_sources.StellarDBLayout import Plan
+
+LAYOUT = {
+    "name": {"name": "hostname", "unit": "str"},
+    "t_eff": {"name": "st_teff", "unit": "K"},
+    "coordinates": {
+        "__module__": "astropy.coordinates",
+        "__class__": "SkyCoord",
+        "ra": {"name": "ra", "unit": "deg"},
+        "dec": {"name": "dec", "unit": "deg"},
+    },
+}
+
+
+def make_data(n=31):
+    return {
+        "hostname": ["Star %i" % i for i in range(n)],
+        "st_teff": np.linspace(3000, 6000, n),
+        "ra": np.linspace(0, 300, n),
+        "dec": np.linspace(-60, 60, n),
+    }
+
+
+def check(results, data, rows):
+    assert len(results) == len(rows)
+    for result, i in zip(results, rows):
+        assert result["name"] == data["hostname"][i]
+        assert result["t_eff"] == data["st_teff"][i] * u.K
+        assert np.isclose(result["coordinates"].ra.deg, data["ra"][i])
+        assert np.isclose(result["coordinates"].dec.deg, data["dec"][i])
+
+
+def test_apply_table_dataframe_uses_positions():
+    data = make_data()
+    # A slice of a larger table keeps its original index labels
+    df = pd.DataFrame(data).iloc[[29, 30]]
+    results = Plan(LAYOUT).apply_table(df)
+    check(results, data, [29, 30])
+
+
+def test_apply_table_dataframe_rows():
+    data = make_data()
+    df = pd.DataFrame(data).iloc[10:]
+    results = Plan(LAYOUT).apply_table(df, rows=[0, 19])
+    check(results, data, [10, 29])
+
+
+def test_apply_table_qtable():
+    data = make_data()
+    table = QTable(data)
+    results = Plan(LAYOUT).apply_table(table, rows=[0, 29])
+    check(results, data, [0, 29])
+
+
+def test_apply_table_matches_apply():
+    data = make_data()
+    df = pd.DataFrame(data)
+    plan = Plan(LAYOUT)
+    for i, result in zip([5, 6], plan.apply_table(df, rows=[5, 6])):
+        single = plan.apply(df.iloc[[i]])
+        assert single["name"] == result["name"]
+        assert single["t_eff"] == result["t_eff"]